@@ -0,0 +1,69 @@
+# Python 3
+"""
+Compare the row by row parser against the columnar engine on a large synthetic export.
+
+Run from the repository root:
+    python benchmarks/bench_columnar.py --responses 100000
+"""
+
+import argparse
+import csv
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import columnar
+import survey_response
+from synthetic_export import write_export
+
+
+def time_parser(parser, path, repeat):
+    """
+    Parse the file repeat times and keep the best time
+    :param parser:
+    :param path:
+    :param repeat:
+    :return:
+    The best time in seconds and the parsed list
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        with io.open(path, 'r', encoding="utf-8", newline='') as f:
+            start = time.perf_counter()
+            # The row parser builds its list lazily, so listing it is part of the work
+            result = list(parser(csv.reader(f))[0])
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "export.csv")
+        write_export(path, args.students, args.responses)
+
+        rows_time, rows_result = time_parser(survey_response.parse_rows, path, args.repeat)
+        columnar_time, columnar_result = time_parser(columnar.parse_rows_columnar, path, args.repeat)
+
+    print("Responses:       " + str(args.responses) + " over " + str(args.students) + " students")
+    print("NumPy:           " + ("yes" if columnar.numpy is not None else "no, using the array module"))
+    print("Row parser:      {0:.3f}s ({1:,.0f} rows/s)".format(rows_time, args.responses / rows_time))
+    print("Columnar engine: {0:.3f}s ({1:,.0f} rows/s)".format(columnar_time, args.responses / columnar_time))
+    print("Speedup:         {0:.2f}x".format(rows_time / columnar_time))
+    if rows_result != columnar_result:
+        print("The engines disagree!")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the columnar parsing engine')
+    parser.add_argument('--students', type=int, default=40, help='Number of students. (Default 40)')
+    parser.add_argument('--responses', type=int, default=100000, help='Number of reviews. (Default 100000)')
+    parser.add_argument('--repeat', type=int, default=3, help='Best of how many runs. (Default 3)')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,67 @@
+# Python 3
+"""
+Time the memory mapped parallel parser against the row parser on a large synthetic export, with a growing number of
+worker processes.
+
+Run from the repository root:
+    python benchmarks/bench_mmap.py --responses 1000000 --workers 1 2 4 8
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mmap_parse
+import survey_response
+from synthetic_export import write_export
+
+
+def timed(parse, *args):
+    """
+    :param parse: A parse_file like function
+    :param args:
+    :return:
+    The time in seconds and the parsed list
+    """
+    start = time.perf_counter()
+    # The parsed list is built lazily, so listing it is part of the work
+    result = list(parse(*args)[0])
+    return time.perf_counter() - start, result
+
+
+def main(args):
+    # Always split, so small test runs still go through the workers
+    mmap_parse.MIN_PARALLEL_BYTES = 0
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "export.csv")
+        write_export(path, args.students, args.responses)
+        size = os.path.getsize(path)
+
+        rows_time, rows_result = timed(survey_response.parse_file, path)
+        results = [(workers,) + timed(mmap_parse.parse_file_mmap, path, None, workers) for workers in args.workers]
+
+    print("Responses:  " + str(args.responses) + " over " + str(args.students) + " students, " +
+          "{0:.1f} MB".format(size / 1024 / 1024))
+    print("Row parser: {0:.3f}s ({1:,.0f} rows/s)".format(rows_time, args.responses / rows_time))
+    disagree = False
+    for workers, mmap_time, mmap_result in results:
+        print("mmap, {0:>2} workers: {1:.3f}s ({2:,.0f} rows/s, {3:.2f}x)".format(
+            workers, mmap_time, args.responses / mmap_time, rows_time / mmap_time))
+        disagree = disagree or mmap_result != rows_result
+    if disagree:
+        print("The parsers disagree!")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the memory mapped parallel parser')
+    parser.add_argument('--students', type=int, default=40, help='Number of students. (Default 40)')
+    parser.add_argument('--responses', type=int, default=1000000, help='Number of reviews. (Default 1000000)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                        help='The worker counts to try. (Default 1 2 4)')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,170 @@
+# Python 3
+"""
+Run the whole survey_response pipeline against a local fake Qualtrics server and report how long each stage takes,
+how much memory it needs and how many responses per second go through it.
+
+Run from the repository root:
+    python benchmarks/bench_pipeline.py --sizes 1000,10000,100000
+Save the results and compare a later run against them to catch regressions:
+    python benchmarks/bench_pipeline.py --json baseline.json
+    python benchmarks/bench_pipeline.py --baseline baseline.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import survey_response
+from fake_qualtrics import serve_synthetic
+from instrumentation import peak_rss_mb
+from qualtrics_client import QualtricsClient
+
+# Stages that don't depend on the network, these are the ones compared against a baseline
+COMPARED_STAGES = ("parse", "student files", "all info")
+
+
+def peak_memory():
+    """
+    The peak memory of the stage that just ran, in MB. With tracing on it is what Python allocated during the stage,
+    otherwise it is the peak resident size of the whole process so far.
+    :return:
+    """
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    return peak_rss_mb() or 0.0
+
+
+def run_stage(timings, name, func, *args):
+    """
+    Run one stage, recording its wall time and peak memory
+    :param timings: The dictionary to record the stage in
+    :param name:
+    :param func:
+    :param args:
+    :return:
+    Whatever the stage returned
+    """
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    timings[name] = {"seconds": elapsed, "peak_mb": peak_memory()}
+    return result
+
+
+def run_pipeline(students, responses, engine, directory):
+    """
+    Run every stage of survey_response.main on a synthetic export
+    :param students:
+    :param responses:
+    :param engine:
+    :param directory: A scratch directory
+    :return:
+    The timing of each stage
+    """
+    timings = {}
+    fake = serve_synthetic(os.path.join(directory, "source.csv"), students, responses)
+    work = os.path.join(directory, "work")
+    survey_response.make_directory(work)
+
+    with fake:
+        client = QualtricsClient("token", base_url=fake.base_url, pool_size=1)
+        downloaded_file = run_stage(timings, "download", survey_response.download_file, "token", "SV_bench", 600,
+                                    client)
+        zip_file, zip_path = run_stage(timings, "unzip", survey_response.unzip_file, downloaded_file, work)
+    file_name, file_name_date = run_stage(timings, "rename", survey_response.rename_zipped, zip_file, work)
+    zip_file.close()
+    parsed_list, structure, numeric = run_stage(timings, "parse", survey_response.parse_file,
+                                       os.path.join(work, file_name_date), engine)
+
+    survey_directory = os.path.join(work, file_name)
+    run_stage(timings, "directory", lambda: (survey_response.make_directory(survey_directory),
+                                             survey_response.move_to_directory(survey_directory, file_name_date,
+                                                                               work)))
+    run_stage(timings, "student files", survey_response.write_student_file, parsed_list, structure, numeric, 4,
+              None, survey_directory)
+    run_stage(timings, "all info", survey_response.write_all_info, file_name, parsed_list, structure, numeric,
+              survey_directory)
+    return timings
+
+
+def report(size, timings):
+    total = sum(stage["seconds"] for stage in timings.values())
+    print("\n{0:,} responses".format(size))
+    print("  {0:<14} {1:>9} {2:>11}".format("stage", "seconds", "peak MB"))
+    for name, stage in timings.items():
+        print("  {0:<14} {1:>9.3f} {2:>11.1f}".format(name, stage["seconds"], stage["peak_mb"]))
+    print("  {0:<14} {1:>9.3f}".format("total", total))
+    print("  parse throughput {0:,.0f} responses/s, end to end {1:,.0f} responses/s".format(
+        size / timings["parse"]["seconds"], size / total))
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the offline stages against a saved run
+    :param results:
+    :param baseline:
+    :param tolerance: How much slower a stage may be, 0.25 is 25%
+    :return:
+    A list of regressions
+    """
+    regressions = []
+    for size, timings in results.items():
+        for name in COMPARED_STAGES:
+            try:
+                before = baseline[size][name]["seconds"]
+            except KeyError:
+                continue
+            after = timings[name]["seconds"]
+            if after > before * (1 + tolerance):
+                regressions.append("{0} responses, {1}: {2:.3f}s, was {3:.3f}s".format(size, name, after, before))
+    return regressions
+
+
+def main(args):
+    results = {}
+    if args.trace_memory:
+        # Tracing makes everything several times slower, so timings from a traced run aren't comparable
+        tracemalloc.start()
+    for size in [int(size) for size in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            results[str(size)] = run_pipeline(args.students, size, args.engine, directory)
+        report(size, results[str(size)])
+    if args.trace_memory:
+        tracemalloc.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print("  " + regression)
+            sys.exit(1)
+        print("\nNo regressions against " + args.baseline)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the survey_response pipeline end to end')
+    parser.add_argument('--sizes', type=str, default='1000,10000,100000',
+                        help='Comma separated numbers of responses to run. (Default 1000,10000,100000)')
+    parser.add_argument('--students', type=int, default=40, help='Number of students. (Default 40)')
+    parser.add_argument('--engine', type=str, choices=['rows', 'columnar'], default='rows')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Measure the memory of each stage with tracemalloc. Slows the run down a lot.')
+    parser.add_argument('--json', type=str, help='Save the results to this file.')
+    parser.add_argument('--baseline', type=str, help='Compare against results saved with --json.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='How much slower a stage may get before it counts as a regression. (Default 0.25)')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,93 @@
+# Python 3
+"""
+Time post_to_qualtrics.read_file on a large roster, as a csv attendance sheet and as a text file.
+
+Run from the repository root:
+    python benchmarks/bench_roster.py --lines 1000000
+"""
+
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import post_to_qualtrics
+
+
+def write_rosters(directory, lines, unique, seed=0):
+    """
+    Write the same roster as a csv attendance sheet (like Sample.csv) and as a text file
+    :param directory:
+    :param lines:
+    :param unique: How many different students there are. The rest of the lines repeat them, like a roster
+    covering several sections or semesters.
+    :param seed:
+    :return:
+    The csv path and the text path
+    """
+    rnd = random.Random(seed)
+    csv_path = os.path.join(directory, "roster.csv")
+    text_path = os.path.join(directory, "roster.txt")
+    ids = [rnd.randint(0, unique - 1) for _ in range(lines)]
+    names = ["Last" + str(i) + " Jr, First" + str(i % 7) for i in ids]
+    with open(csv_path, "w", newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Name", "5-Nov", "7-Nov", "12-Nov", "14-Nov", "19-Nov", "21-Nov", "26-Nov", "28-Nov"])
+        for name in names:
+            writer.writerow([name, "", "", "", "", "", "", "", ""])
+    with open(text_path, "w") as f:
+        for name in names:
+            f.write(name + "\n")
+    return csv_path, text_path
+
+
+def read_csv_every_column(location):
+    """
+    The old way of reading the csv roster, for comparison
+    :param location:
+    :return:
+    """
+    students = []
+    with open(location, 'r') as file:
+        for studentName in csv.reader(file):
+            if studentName[0] != 'Name':
+                students.append(studentName[0])
+    students.sort()
+    return students
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path, text_path = write_rosters(directory, args.lines, args.unique or max(1, args.lines // 10))
+        old_time, old_students = timed(read_csv_every_column, csv_path)
+        csv_time, csv_students = timed(post_to_qualtrics.read_file, csv_path)
+        text_time, text_students = timed(post_to_qualtrics.read_file, text_path)
+
+    print("Lines:              " + str(args.lines))
+    print("Unique students:    " + str(len(csv_students)))
+    print("Old csv reader:     {0:.3f}s".format(old_time))
+    print("Streaming csv:      {0:.3f}s ({1:,.0f} lines/s)".format(csv_time, args.lines / csv_time))
+    print("Streaming text:     {0:.3f}s ({1:,.0f} lines/s)".format(text_time, args.lines / text_time))
+    if csv_students != sorted(set(old_students)) or text_students != csv_students:
+        print("The readers disagree!")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark reading a roster')
+    parser.add_argument('--lines', type=int, default=1000000, help='Number of students. (Default 1000000)')
+    parser.add_argument('--unique', type=int,
+                        help='How many different students there are. (Default 1 per 10 lines)')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,99 @@
+# Python 3
+"""
+Time the cold start of the survey command, and check that the offline commands don't import the network stack or
+any of the optional heavy modules.
+
+Each command is started in a fresh interpreter. The time of an interpreter doing nothing is shown too, the difference
+is what our imports cost.
+
+Run from the repository root:
+    python benchmarks/bench_startup.py --runs 20 --max-ms 150
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What is timed. parse and report never talk to Qualtrics, so they must start without the heavy modules.
+COMMANDS = [
+    ("survey --help", ["--help"], False),
+    ("survey parse --help", ["parse", "--help"], True),
+    ("survey report --help", ["report", "--help"], True),
+    ("survey export --help", ["export", "--help"], False),
+    ("survey upload --help", ["upload", "--help"], False),
+]
+# Modules that should only be imported by the commands that need them
+HEAVY = ["requests", "urllib3", "asyncio", "numpy", "pyarrow"]
+
+# Runs the command in-process and prints which heavy modules it imported
+LOADED = """
+import json, sys
+arguments, heavy = json.loads(sys.argv[1]), json.loads(sys.argv[2])
+import survey_cli
+try:
+    survey_cli.main(arguments)
+except SystemExit:
+    pass
+print(json.dumps([name for name in heavy if name in sys.modules]), file=sys.stderr)
+"""
+
+
+def cold_start(command, runs):
+    """
+    :param command: The arguments to the python interpreter
+    :param runs:
+    :return:
+    The run times in ms
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + command, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def heavy_imports(arguments):
+    """
+    :param arguments: The survey command's arguments
+    :return:
+    The heavy modules the command imported
+    """
+    result = subprocess.run([sys.executable, "-c", LOADED, json.dumps(arguments), json.dumps(HEAVY)], cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return json.loads(result.stderr.strip().splitlines()[-1])
+
+
+def main(args):
+    interpreter = statistics.median(cold_start(["-c", "pass"], args.runs))
+    print("  {0:<24}{1:>10}{2:>10}   {3}".format("command", "median ms", "ours ms", "heavy imports"))
+    print("  {0:<24}{1:>10.1f}".format("python -c pass", interpreter))
+    failed = False
+    for name, arguments, offline in COMMANDS:
+        median = statistics.median(cold_start([os.path.join(ROOT, "survey_cli.py")] + arguments, args.runs))
+        loaded = heavy_imports(arguments)
+        print("  {0:<24}{1:>10.1f}{2:>10.1f}   {3}".format(name, median, median - interpreter,
+                                                          ", ".join(loaded) or "-"))
+        if offline and loaded:
+            print("  " + name + " imported " + ", ".join(loaded))
+            failed = True
+        if offline and args.max_ms is not None and median - interpreter > args.max_ms:
+            print("  " + name + " took longer than " + str(args.max_ms) + " ms to start")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the cold start of the survey command')
+    parser.add_argument('--runs', type=int, default=10, help='How many times to start each command. (Default 10)')
+    parser.add_argument('--max-ms', type=float,
+                        help='Fail if an offline command takes longer than this to start, on top of the interpreter.')
+    args = parser.parse_args()
+    main(args)
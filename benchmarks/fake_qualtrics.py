@@ -0,0 +1,148 @@
+# Python 3
+"""
+A local stand in for the parts of the Qualtrics API these scripts use, so the whole pipeline can be run without a
+network or a real survey.
+
+    responseexports/               POST starts an export of a synthetic survey
+    responseexports/<id>           GET reports progress, the export "finishes" after a few checks
+    responseexports/<id>/file      GET downloads the zipped export
+    surveys/<id>                   GET returns the survey with its embedded data and response count
+    surveys/<id>/embeddeddatafields POST stores embedded data
+"""
+
+import http.server
+import io
+import json
+import re
+import threading
+import zipfile
+
+from synthetic_export import write_export
+
+
+def zip_export(path, name="ECEN 160.csv"):
+    """
+    Zip an export the way Qualtrics does, one csv file inside
+    :param path: The csv file
+    :param name: The name of the file inside the zip
+    :return:
+    The bytes of the zip file
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zipped:
+        zipped.write(path, name)
+    return buffer.getvalue()
+
+
+class FakeQualtrics:
+    """
+    The fake server. Use it as a context manager, the server runs in a background thread.
+    """
+    def __init__(self, export_path, responses=0, checks_until_done=2):
+        """
+        :param export_path: The csv export to serve
+        :param responses: The response count reported for the survey
+        :param checks_until_done: How many progress checks it takes for an export to finish
+        """
+        self.export = zip_export(export_path)
+        self.responses = responses
+        self.checks_until_done = checks_until_done
+        self.embedded_data = {}
+        self.requests = 0
+        self.server = None
+        self.thread = None
+
+    @property
+    def base_url(self):
+        """
+        The url to hand to QualtricsClient, only valid once the server is started
+        :return:
+        """
+        return "http://127.0.0.1:{0}/API/v3/".format(self.server.server_port)
+
+    def __enter__(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handler(self):
+        fake = self
+        checks = {}
+        lock = threading.Lock()
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body, content_type="application/json", status=200):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def ok(self, result):
+                self.reply({"meta": {"httpStatus": "200 - OK"}, "result": result})
+
+            def do_GET(self):
+                with lock:
+                    fake.requests += 1
+                path = self.path.split("?")[0]
+                match = re.search(r"/responseexports/([^/]+)(/file)?$", path)
+                if match and match.group(2):
+                    return self.reply(fake.export, "application/zip")
+                if match:
+                    with lock:
+                        checks[match.group(1)] = checks.get(match.group(1), 0) + 1
+                        done = checks[match.group(1)] >= fake.checks_until_done
+                    return self.ok({"percentComplete": 100.0 if done else 50.0,
+                                    "status": "complete" if done else "in progress"})
+                match = re.search(r"/surveys/([^/]+)$", path)
+                if match:
+                    return self.ok({"id": match.group(1),
+                                    "responseCounts": {"auditable": fake.responses, "generated": 0, "deleted": 0},
+                                    "embeddedData": [{"name": key, "defaultValue": value}
+                                                     for key, value in fake.embedded_data.items()]})
+                self.reply({"meta": {"httpStatus": "404 - Not Found"}}, status=404)
+
+            def do_POST(self):
+                with lock:
+                    fake.requests += 1
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                path = self.path.split("?")[0]
+                if path.endswith("/responseexports/"):
+                    with lock:
+                        progress_id = "ES_" + str(len(checks) + 1)
+                        checks[progress_id] = 0
+                    return self.ok({"id": progress_id})
+                if path.endswith("/embeddeddatafields"):
+                    with lock:
+                        for field in body.get("embeddedDataFields", []):
+                            fake.embedded_data[field["key"]] = field["value"]
+                    return self.ok({})
+                self.reply({"meta": {"httpStatus": "404 - Not Found"}}, status=404)
+
+        return Handler
+
+
+def serve_synthetic(path, students, responses, seed=0, checks_until_done=2):
+    """
+    Write a synthetic export and get a fake server ready to serve it
+    :param path: Where to write the csv file
+    :param students:
+    :param responses:
+    :param seed:
+    :param checks_until_done:
+    :return:
+    The FakeQualtrics, not started yet
+    """
+    write_export(path, students, responses, seed)
+    return FakeQualtrics(path, responses, checks_until_done)
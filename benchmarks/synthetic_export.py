@@ -0,0 +1,99 @@
+# Python 3
+"""
+Generate a fake Qualtrics export that looks like the ones survey_response.py downloads.
+
+The file has the three header rows, the metadata columns, one studentNN embedded data column per student, the select
+student question, the rubric questions and the location columns at the end.
+"""
+
+import argparse
+import csv
+import io
+import random
+
+METADATA = ["ResponseID", "ResponseSet", "IPAddress", "StartDate", "EndDate", "RecipientLastName",
+            "RecipientFirstName", "RecipientEmail", "ExternalDataReference", "Finished", "Status", "Duration",
+            "RecordedDate", "DistributionChannel"]
+NUMERIC_QUESTIONS = ["Organization_1", "Professionalism_1", "Technical Details_1", "Visual Aids_1"]
+TEXT_QUESTIONS = ["Compliment", "Improvement"]
+LOCATION = ["LocationLatitude", "LocationLongitude", "LocationAccuracy"]
+COMMENTS = ["Great job", "Speak up", "Clear slides", "Needed more detail, but\nthe demo was good", ""]
+
+
+def header(students):
+    """
+    The column names of an export
+    :param students: The number of students
+    :return:
+    """
+    slots = ["student" + str(i + 1) for i in range(students)]
+    return METADATA + slots + ["Select Student"] + NUMERIC_QUESTIONS + TEXT_QUESTIONS + LOCATION
+
+
+def import_id(column):
+    """
+    The third header row entry for a column. Questions get a QID, free text answers end in _TEXT.
+    :param column:
+    :return:
+    """
+    if column == "Select Student":
+        qid = "QID7"
+    elif column in NUMERIC_QUESTIONS:
+        qid = "QID" + str(NUMERIC_QUESTIONS.index(column) + 1) + "_1"
+    elif column in TEXT_QUESTIONS:
+        qid = "QID" + str(len(NUMERIC_QUESTIONS) + TEXT_QUESTIONS.index(column) + 1) + "_TEXT"
+    else:
+        qid = column
+    return '{"ImportId":"' + qid + '"}'
+
+
+def generate_rows(students, responses, seed=0):
+    """
+    Generate the rows of an export, headers included
+    :param students: The number of students in the class
+    :param responses: The number of reviews
+    :param seed:
+    :return:
+    A generator of csv rows
+    """
+    rnd = random.Random(seed)
+    columns = header(students)
+    names = ["Last" + str(i) + ", First" + str(i) for i in range(students)]
+
+    yield columns
+    yield columns
+    yield [import_id(column) for column in columns]
+    for r in range(responses):
+        row = ["R_" + str(r).zfill(8), "Default Response Set", "10.0.0." + str(rnd.randint(1, 254)),
+               "2018-09-05 10:00:00", "2018-09-05 10:05:00", "", "", "", "", "1", "0", "300",
+               "2018-09-05 10:05:00", "anonymous"]
+        row += names
+        row.append(str(rnd.randint(1, students)))
+        # Now and then someone skips a question
+        row += [str(rnd.randint(0, 10)) if rnd.random() > 0.05 else "" for _ in NUMERIC_QUESTIONS]
+        row += [rnd.choice(COMMENTS) for _ in TEXT_QUESTIONS]
+        row += ["43.8231", "-111.7924", "-1"]
+        yield row
+
+
+def write_export(path, students, responses, seed=0):
+    """
+    Write a synthetic export to disk
+    :param path:
+    :param students:
+    :param responses:
+    :param seed:
+    :return:
+    """
+    with io.open(path, "w", encoding="utf-8", newline='') as f:
+        csv.writer(f).writerows(generate_rows(students, responses, seed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write a synthetic Qualtrics export')
+    parser.add_argument('path', type=str, help='Where to write the csv file')
+    parser.add_argument('--students', type=int, default=40, help='Number of students. (Default 40)')
+    parser.add_argument('--responses', type=int, default=1000, help='Number of reviews. (Default 1000)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_export(args.path, args.students, args.responses, args.seed)
@@ -0,0 +1,241 @@
+# Python 3
+"""
+A columnar engine for parsing the survey export.
+
+Instead of building a dictionary of lists for every student and converting each cell back and forth, the responses
+are loaded into one typed array per question. The per student counts, averages and score lists are then computed
+with grouped reductions over those arrays. NumPy is used when it is installed, otherwise the standard library array
+module is used and the reductions are done in plain Python.
+"""
+
+import array
+import math
+import re
+
+from export_schema import ExportSchema
+from student_record import to_number
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# How many responses are looked at to decide whether a question is numeric or free text
+TYPE_SAMPLE_ROWS = 100
+
+
+def infer_numeric(sample):
+    """
+    Decide once, from a sample of answers, which questions hold scores. Only needed when the export has no import ids
+    to tell us.
+    :param sample: A list of answer lists
+    :return:
+    A list of booleans, True for the numeric questions
+    """
+    numeric = []
+    for answers in zip(*sample):
+        seen = False
+        is_numeric = True
+        for value in answers:
+            value = value.strip()
+            if not value:
+                continue
+            seen = True
+            try:
+                to_number(value)
+            except ValueError:
+                is_numeric = False
+                break
+        numeric.append(seen and is_numeric)
+    return numeric
+
+
+class Columns:
+    """
+    The responses, one typed column per question
+    """
+    def __init__(self, numeric):
+        self.numeric = numeric
+        # Which student each response is about
+        self.groups = array.array('l')
+        # Numeric questions hold a float per response, NaN when it was left blank. Free text questions hold
+        # (student, comment) pairs for the comments that were actually left.
+        self.values = [array.array('d') if is_numeric else [] for is_numeric in numeric]
+        # Which responses to each numeric question were decimals, the rest were whole numbers. Usually empty.
+        self.decimals = [set() if is_numeric else None for is_numeric in numeric]
+
+    def append(self, group, cells):
+        response = len(self.groups)
+        self.groups.append(group)
+        for is_numeric, column, decimals, cell in zip(self.numeric, self.values, self.decimals, cells):
+            if is_numeric:
+                # The same conversion as the row parser, so a decimal slider score stays a decimal
+                try:
+                    number = to_number(cell)
+                except ValueError:
+                    column.append(math.nan)
+                    continue
+                column.append(number)
+                if isinstance(number, float):
+                    decimals.add(response)
+            elif cell.strip():
+                column.append((group, cell))
+
+
+class ParsedRows(list):
+    """
+    The parsed list, along with how many responses went into it
+    """
+    def __init__(self, rows=(), added=0):
+        super().__init__(rows)
+        self.added = added
+
+
+def group_scores(groups, values, size, decimals=()):
+    """
+    Compute the count, sum and individual scores of every student for one numeric question
+    :param groups: The student of each response
+    :param values: The score of each response, NaN for blanks
+    :param size: The number of students
+    :param decimals: The responses whose score was a decimal. The other scores are whole numbers.
+    :return:
+    A list of counts, a list of sums and a list of score lists, indexed by student
+    """
+    if numpy is not None:
+        groups = numpy.frombuffer(groups, dtype=numpy.dtype(groups.typecode))
+        values = numpy.frombuffer(values, dtype=numpy.float64)
+        answered = ~numpy.isnan(values)
+        groups = groups[answered]
+        values = values[answered]
+        counts = numpy.bincount(groups, minlength=size)
+        sums = numpy.bincount(groups, weights=values, minlength=size)
+        # A stable sort keeps each student's scores in the order the reviews came in
+        order = numpy.argsort(groups, kind='stable')
+        splits = numpy.cumsum(counts)[:-1]
+        if not decimals:
+            scores = [score.tolist() for score in numpy.split(values[order].astype(numpy.int64), splits)]
+        else:
+            responses = numpy.flatnonzero(answered)[order].tolist()
+            ordered = [value if response in decimals else int(value)
+                       for value, response in zip(values[order].tolist(), responses)]
+            scores = [ordered[start:end] for start, end in zip([0] + splits.tolist(), splits.tolist() + [len(ordered)])]
+        return counts.tolist(), sums.tolist(), scores
+
+    counts = [0] * size
+    sums = [0.0] * size
+    scores = [[] for _ in range(size)]
+    for response, (group, value) in enumerate(zip(groups, values)):
+        if value == value:  # NaN is never equal to itself
+            counts[group] += 1
+            sums[group] += value
+            scores[group].append(value if response in decimals else int(value))
+    return counts, sums, scores
+
+
+def load_sample(sample, slots, numeric):
+    """
+    Decide the question types from the held back responses and load them into columns
+    :param sample: A list of (student id, answers)
+    :param slots: Student id to student index
+    :param numeric: The question types the schema already knows, None where it doesn't
+    :return:
+    The columns
+    """
+    if sample:
+        inferred = infer_numeric([answers for _, answers in sample])
+    else:
+        inferred = [False] * len(numeric)
+    columns = Columns([known if known is not None else guess for known, guess in zip(numeric, inferred)])
+    for student_id, answers in sample:
+        columns.append(slots[student_id], answers)
+    return columns
+
+
+def parse_rows_columnar(rows):
+    """
+    Collect all of the information from the reviews and organize it under the student, column by column.
+    Produces the same parsed list as survey_response.parse_rows.
+    :param rows: An iterator of csv rows from the survey export, headers included
+    :return:
+    The parsed list, the question names and which questions are numeric
+    """
+    rows = iter(rows)
+    schema = ExportSchema(next(rows))
+    structure = schema.structure
+    order = schema.student_ids
+    slots = {student_id: index for index, student_id in enumerate(order)}
+    names = [("", "")] * len(order)
+    columns = None
+    sample = []
+
+    for r, row in enumerate(rows, start=1):
+        if r == 2:
+            schema.read_import_ids(row)
+        if r < 3:
+            continue
+        if r == 3:
+            # The first response also carries everyone's names
+            for index, name in enumerate(schema.names(row)):
+                parts = re.split(", ", name or "BLANK, BLANK")
+                names[index] = (parts[0], parts[1])
+
+        student_id = schema.student_id(row)
+        answers = schema.answers(row)
+        if columns is None:
+            if None not in schema.numeric:
+                # The header already told us every question type
+                columns = Columns(schema.numeric)
+            else:
+                # Hold on to the first responses until we know the type of every question
+                sample.append((student_id, answers))
+                if len(sample) < TYPE_SAMPLE_ROWS:
+                    continue
+                columns = load_sample(sample, slots, schema.numeric)
+                continue
+        columns.append(slots[student_id], answers)
+
+    if columns is None:
+        columns = load_sample(sample, slots, schema.numeric)
+
+    size = len(order)
+    if numpy is not None:
+        review_counts = numpy.bincount(numpy.frombuffer(columns.groups, dtype=numpy.dtype(columns.groups.typecode)),
+                                       minlength=size).tolist()
+    else:
+        review_counts = [0] * size
+        for group in columns.groups:
+            review_counts[group] += 1
+
+    numeric_results = []
+    comments = []
+    for is_numeric, values, decimals in zip(columns.numeric, columns.values, columns.decimals):
+        if is_numeric:
+            numeric_results.append(group_scores(columns.groups, values, size, decimals))
+        else:
+            per_student = [[] for _ in range(size)]
+            for group, comment in values:
+                per_student[group].append(comment)
+            comments.append(per_student)
+
+    parsed_list = ParsedRows(added=len(columns.groups))
+    for student in range(size):
+        averages = []
+        scores = []
+        for counts, sums, score_lists in numeric_results:
+            averages.append(round(sums[student] / counts[student], 2) if counts[student] else None)
+            scores.append(score_lists[student])
+
+        # Skip the students that haven't been reviewed
+        if not any(scores):
+            continue
+
+        last, first = names[student]
+        parsed = [last, first, review_counts[student],
+                  str(round(sum(average for average in averages if average is not None), 1))]
+        parsed += [str(average) for average in averages]
+        parsed += [per_student[student] for per_student in comments]
+        parsed += scores
+        parsed_list.append(parsed)
+
+    parsed_list.sort(key=lambda sort: sort[0])
+    return parsed_list, structure, list(columns.numeric)
@@ -0,0 +1,161 @@
+# Python 3
+"""
+An on disk cache of downloaded survey exports.
+
+Exports are kept by survey id along with the number of responses the survey had when it was downloaded. Within the
+time to live an export is used as is. After that, the survey's response count is checked (one small request) and the
+export is only downloaded again if it changed. The cache is kept under a size limit by dropping the least recently
+used exports.
+"""
+
+import io
+import json
+import os
+import time
+
+DEFAULT_DIRECTORY = ".survey_cache"
+INDEX = "index.json"
+
+
+class CachedExport:
+    """
+    A cached export that looks enough like a streamed download for unzip_file and stream_export to read it
+    """
+    def __init__(self, path):
+        self.path = path
+        self.headers = {"Content-Length": str(os.path.getsize(path))}
+
+    def iter_content(self, chunk_size=64 * 1024):
+        """
+        Read the cached zip file a chunk at a time
+        :param chunk_size:
+        :return:
+        """
+        with open(self.path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+
+class ExportCache:
+    """
+    The cache directory and its index
+    """
+    def __init__(self, directory=DEFAULT_DIRECTORY, ttl=3600, max_bytes=500 * 1024 * 1024):
+        """
+        :param directory: Where the exports are kept
+        :param ttl: How many seconds an export is used without checking the survey for new responses
+        :param max_bytes: How big the cache may get before old exports are dropped
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.index = self.load_index()
+
+    def load_index(self):
+        """
+        :return:
+        The index, survey id to what is known about its cached export
+        """
+        try:
+            with io.open(os.path.join(self.directory, INDEX), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            print("The cache index is unreadable, starting with an empty cache")
+            return {}
+
+    def save_index(self):
+        """
+        Save the index through a temporary file so it is never left half written
+        :return:
+        """
+        path = os.path.join(self.directory, INDEX)
+        with io.open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(path + ".tmp", path)
+
+    def path(self, survey_token):
+        """
+        :param survey_token:
+        :return:
+        Where the export of this survey is kept
+        """
+        return os.path.join(self.directory, survey_token + ".zip")
+
+    def get(self, survey_token, response_count=None, any_age=False):
+        """
+        Get a cached export if it can be used
+        :param survey_token:
+        :param response_count: The survey's current response count. The export is used if it had the same count.
+        :param any_age: Use the export no matter how old it is, for working offline
+        :return:
+        A CachedExport, or None if the export has to be downloaded
+        """
+        entry = self.index.get(survey_token)
+        if entry is None or not os.path.isfile(self.path(survey_token)):
+            return None
+
+        now = time.time()
+        fresh = any_age or now - entry["checked"] < self.ttl
+        if not fresh and response_count is not None and response_count == entry["responses"]:
+            # Nothing new since it was downloaded, good for another ttl
+            entry["checked"] = now
+            fresh = True
+        if not fresh:
+            return None
+
+        entry["used"] = now
+        self.save_index()
+        print("Using cached export of " + survey_token + " from " + time.ctime(entry["downloaded"]))
+        return CachedExport(self.path(survey_token))
+
+    def put(self, survey_token, response_count, request_download):
+        """
+        Save a download in the cache
+        :param survey_token:
+        :param response_count: The survey's response count when the export was made
+        :param request_download: The streamed download
+        :return:
+        A CachedExport to read the download back from
+        """
+        path = self.path(survey_token)
+        try:
+            with open(path + ".tmp", "wb") as f:
+                for chunk in request_download.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            print("Failed to save the export of " + survey_token + " in the cache.")
+            raise
+
+        now = time.time()
+        self.index[survey_token] = {"responses": response_count, "downloaded": now, "checked": now, "used": now,
+                                    "size": os.path.getsize(path)}
+        self.evict(keep=survey_token)
+        self.save_index()
+        return CachedExport(path)
+
+    def evict(self, keep=None):
+        """
+        Drop the least recently used exports until the cache fits in max_bytes
+        :param keep: An export that must stay, the one being used right now
+        :return:
+        """
+        total = sum(entry["size"] for entry in self.index.values())
+        for survey_token, entry in sorted(self.index.items(), key=lambda item: item[1]["used"]):
+            if total <= self.max_bytes:
+                break
+            if survey_token == keep:
+                continue
+            try:
+                os.remove(self.path(survey_token))
+            except FileNotFoundError:
+                pass
+            total -= entry["size"]
+            del self.index[survey_token]
+            print("Dropped the cached export of " + survey_token)
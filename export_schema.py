@@ -0,0 +1,140 @@
+# Python 3
+"""
+Where everything is in a survey export.
+
+The schema is compiled once from the header row. Every row after that is read with a few indexed lookups, and adding
+or moving metadata columns in Qualtrics doesn't shift the data onto the wrong student.
+"""
+
+import json
+import operator
+import re
+
+# Embedded data columns holding the student names, student1, student2, ...
+STUDENT_SLOT = re.compile(r'^student\d+$')
+SELECT_STUDENT = "Select Student"
+RESPONSE_ID = ("ResponseID", "ResponseId")
+RECORDED_DATE = "RecordedDate"
+# Who filled out the response, most specific first. The IP address isn't one of them, a whole classroom can share it.
+REVIEWER = ("RecipientEmail", "ExternalDataReference", "ExternalReference")
+# Qualtrics puts these after the questions
+LOCATION = ("LocationLatitude", "LocationLongitude", "LocationAccuracy")
+
+
+class SchemaError(ValueError):
+    """
+    The export doesn't look like a student review survey
+    """
+
+
+class ExportSchema:
+    """
+    The column layout of a survey export
+    """
+    def __init__(self, header):
+        """
+        Compile the schema from the first header row
+        :param header: The column names
+        """
+        self.columns = {}
+        for index, name in enumerate(header):
+            # If a name shows up twice the first one wins
+            self.columns.setdefault(name, index)
+
+        # The studentNN embedded data, in column order
+        self.student_columns = [index for index, name in enumerate(header) if STUDENT_SLOT.match(name)]
+        if not self.student_columns:
+            raise SchemaError("No studentNN columns in the export")
+        self.student_ids = [header[index] for index in self.student_columns]
+
+        # The question where the reviewer picked who they were reviewing. Older surveys don't name it, it is the
+        # column right after the students.
+        self.select_column = self.columns.get(SELECT_STUDENT, self.student_columns[-1] + 1)
+        if self.select_column >= len(header):
+            raise SchemaError("No select student column in the export")
+
+        # Every question after the select student question, leaving out the location data
+        self.question_columns = [index for index in range(self.select_column + 1, len(header))
+                                 if header[index] not in LOCATION]
+        # Matrix and slider questions export as Name_1, Name_2. Group them under Name.
+        self.structure = [header[index].split('_')[0] for index in self.question_columns]
+        # None until known. True for numeric questions, False for free text.
+        self.numeric = [None] * len(self.question_columns)
+
+        self.response_id_column = next((self.columns[name] for name in RESPONSE_ID if name in self.columns), 0)
+        self.recorded_date_column = self.columns.get(RECORDED_DATE)
+        self.reviewer_columns = [self.columns[name] for name in REVIEWER if name in self.columns]
+
+        self._answers = operator.itemgetter(*self.question_columns) if self.question_columns else lambda row: ()
+        self._names = operator.itemgetter(*self.student_columns)
+        self.width = len(header)
+
+    def read_import_ids(self, row):
+        """
+        Use the third header row to learn which questions are free text. Qualtrics gives text entry answers an
+        import id ending in _TEXT.
+        :param row: The import id header row
+        :return:
+        """
+        for position, index in enumerate(self.question_columns):
+            try:
+                import_id = json.loads(row[index])["ImportId"]
+            except (IndexError, ValueError, KeyError, TypeError):
+                continue
+            self.numeric[position] = not import_id.endswith("_TEXT")
+
+    def student_id(self, row):
+        """
+        :param row: A response
+        :return:
+        The studentNN id of the student being reviewed
+        """
+        return 'student' + row[self.select_column]
+
+    def answers(self, row):
+        """
+        :param row: A response
+        :return:
+        The answers to the questions, in the same order as structure
+        """
+        answers = self._answers(row)
+        # itemgetter hands back a bare value when there is only one question
+        return answers if isinstance(answers, tuple) else (answers,)
+
+    def names(self, row):
+        """
+        :param row: A response
+        :return:
+        The student names, in the same order as student_ids
+        """
+        names = self._names(row)
+        return names if isinstance(names, tuple) else (names,)
+
+    def response_id(self, row):
+        """
+        :param row: A response
+        :return:
+        The id Qualtrics gave the response
+        """
+        return row[self.response_id_column]
+
+    def recorded_date(self, row):
+        """
+        :param row: A response
+        :return:
+        When the response was recorded, or None if the export doesn't say
+        """
+        if self.recorded_date_column is None:
+            return None
+        return row[self.recorded_date_column]
+
+    def reviewer(self, row):
+        """
+        :param row: A response
+        :return:
+        Who wrote the review, from the first respondent column that isn't blank, or None if they all are
+        """
+        for index in self.reviewer_columns:
+            if index < len(row) and row[index]:
+                return row[index]
+        return None
@@ -0,0 +1,201 @@
+# Python 3
+"""
+A SQLite store of every survey's results, for following students across presentations.
+
+Each parsed survey is inserted once, in batched transactions, and kept with the survey id. The tables are indexed on
+the student's name, the survey and the question, so trends across a semester are indexed queries instead of reading
+every parsed csv again. Run this file to query the store.
+"""
+
+import argparse
+import csv
+import datetime
+import sqlite3
+import sys
+
+DEFAULT_DATABASE = "survey_history.db"
+# How many review scores are inserted per executemany
+INSERT_BATCH = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS surveys (
+    survey TEXT PRIMARY KEY,
+    name TEXT,
+    imported TEXT
+);
+CREATE TABLE IF NOT EXISTS students (
+    survey TEXT NOT NULL,
+    last TEXT NOT NULL,
+    first TEXT NOT NULL,
+    reviewed_count INTEGER
+);
+CREATE TABLE IF NOT EXISTS scores (
+    survey TEXT NOT NULL,
+    last TEXT NOT NULL,
+    first TEXT NOT NULL,
+    question TEXT NOT NULL,
+    score REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS students_name ON students (last, first);
+CREATE INDEX IF NOT EXISTS students_survey ON students (survey);
+CREATE INDEX IF NOT EXISTS scores_name ON scores (last, first, question);
+CREATE INDEX IF NOT EXISTS scores_survey ON scores (survey);
+CREATE INDEX IF NOT EXISTS scores_question ON scores (question, survey);
+"""
+
+# The average, count and range of a student's scores on each question of each survey, oldest survey first
+STUDENT_TREND = """
+SELECT surveys.survey, surveys.name, scores.question, COUNT(*), ROUND(AVG(score), 2), MIN(score), MAX(score)
+FROM scores JOIN surveys ON surveys.survey = scores.survey
+WHERE last = ? AND first = ?
+GROUP BY surveys.survey, scores.question
+ORDER BY surveys.imported, scores.question
+"""
+
+# How a question was scored in each survey, oldest survey first
+QUESTION_SUMMARY = """
+SELECT surveys.survey, surveys.name, COUNT(DISTINCT last || ', ' || first), COUNT(*), ROUND(AVG(score), 2),
+       MIN(score), MAX(score)
+FROM scores JOIN surveys ON surveys.survey = scores.survey
+WHERE question = ?
+GROUP BY surveys.survey
+ORDER BY surveys.imported
+"""
+
+SURVEYS = """
+SELECT surveys.survey, name, imported, COUNT(students.survey)
+FROM surveys LEFT JOIN students ON students.survey = surveys.survey
+GROUP BY surveys.survey
+ORDER BY imported
+"""
+
+
+class HistoryStore:
+    """
+    The database of past surveys
+    """
+    def __init__(self, path=DEFAULT_DATABASE):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, survey_token, parsed_list, structure, numeric, name=None):
+        """
+        Insert the results of a parsed survey. A survey that is already in the store is replaced, so importing the
+        same survey again after more responses came in doesn't count them twice.
+        :param survey_token: The survey ID
+        :param parsed_list: The parsed rows, can be a generator
+        :param structure:
+        :param numeric: Which questions are numeric
+        :param name: What to call the survey in reports, the file name by default
+        :return:
+        The number of scores inserted
+        """
+        questions = [str(key) for key, is_numeric in zip(structure, numeric) if is_numeric]
+        # Where the score lists start in a parsed row
+        first_scores = 4 + len(numeric)
+        inserted = 0
+        # One transaction for the whole survey, committed at the end or rolled back on an error
+        with self.connection:
+            for table in ("scores", "students", "surveys"):
+                self.connection.execute("DELETE FROM " + table + " WHERE survey = ?", (survey_token,))
+            self.connection.execute("INSERT INTO surveys VALUES (?, ?, ?)",
+                                    (survey_token, name, datetime.datetime.now().isoformat(timespec="seconds")))
+            students = []
+            scores = []
+            for student in parsed_list:
+                last, first = student[0], student[1]
+                students.append((survey_token, last, first, student[2]))
+                for question, values in zip(questions, student[first_scores:]):
+                    scores += [(survey_token, last, first, question, value) for value in values]
+                if len(scores) >= INSERT_BATCH:
+                    inserted += self.insert(students, scores)
+                    students = []
+                    scores = []
+            inserted += self.insert(students, scores)
+        print("Saved " + str(inserted) + " scores of survey " + str(survey_token) + " to " + self.path)
+        return inserted
+
+    def insert(self, students, scores):
+        """
+        :param students: Rows of the students table
+        :param scores: Rows of the scores table
+        :return:
+        The number of scores inserted
+        """
+        self.connection.executemany("INSERT INTO students VALUES (?, ?, ?, ?)", students)
+        self.connection.executemany("INSERT INTO scores VALUES (?, ?, ?, ?, ?)", scores)
+        return len(scores)
+
+    def student_trend(self, last, first):
+        """
+        :param last:
+        :param first:
+        :return:
+        Rows of survey, name, question, count, average, minimum and maximum
+        """
+        return self.connection.execute(STUDENT_TREND, (last, first)).fetchall()
+
+    def question_summary(self, question):
+        """
+        :param question:
+        :return:
+        Rows of survey, name, students, count, average, minimum and maximum
+        """
+        return self.connection.execute(QUESTION_SUMMARY, (question,)).fetchall()
+
+    def surveys(self):
+        """
+        :return:
+        Rows of survey, name, when it was imported and how many students it has
+        """
+        return self.connection.execute(SURVEYS).fetchall()
+
+
+def main(args):
+    if args.query != "surveys" and not args.name:
+        print("The " + args.query + " query needs a name")
+        sys.exit()
+    with HistoryStore(args.db) as store:
+        wr = csv.writer(sys.stdout, lineterminator='\n')
+        if args.query == "student":
+            last, _, first = args.name.partition(",")
+            wr.writerow(["Survey", "Name", "Question", "Reviews", "Average", "Min", "Max"])
+            wr.writerows(store.student_trend(last.strip(), first.strip()))
+        elif args.query == "question":
+            wr.writerow(["Survey", "Name", "Students", "Reviews", "Average", "Min", "Max"])
+            wr.writerows(store.question_summary(args.name))
+        else:
+            wr.writerow(["Survey", "Name", "Imported", "Students"])
+            wr.writerows(store.surveys())
+
+
+def add_arguments(parser):
+    """
+    The arguments for querying the history
+    :param parser:
+    :return:
+    """
+    parser.add_argument('query', type=str, choices=['student', 'question', 'surveys'],
+                        help='student: a student\'s scores in every survey. question: how a question was scored in '
+                             'every survey. surveys: the surveys in the store.')
+    parser.add_argument('name', type=str, nargs='?',
+                        help='The student, as "Last, First", or the question.')
+    parser.add_argument('--db', type=str, default=DEFAULT_DATABASE,
+                        help='The history database. (Default ' + DEFAULT_DATABASE + ')')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Query the history of past surveys')
+    add_arguments(parser)
+    args = parser.parse_args()
+    main(args)
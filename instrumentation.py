@@ -0,0 +1,134 @@
+# Python 3
+"""
+Timing and profiling for the stages of a run.
+
+Each stage records its wall time, the bytes and rows it handled and the peak memory of the process when it finished.
+A stage can also be run under cProfile. Everything is saved as a JSON run report, so a slow run can be traced back to
+the export wait, the unzip, the parse or the writing.
+"""
+
+import contextlib
+import datetime
+import io
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """
+    The peak resident memory of this process so far
+    :return:
+    The size in MB, or None where the platform can't tell us
+    """
+    if resource is None:
+        return None
+    # Linux reports kilobytes, macOS bytes
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+
+
+class Stage:
+    """
+    What one stage of the run did. The stage's code can fill in bytes and rows.
+    """
+    __slots__ = ("name", "seconds", "bytes", "rows", "peak_rss_mb", "profile")
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.bytes = None
+        self.rows = None
+        self.peak_rss_mb = None
+        self.profile = None
+
+    def as_dict(self):
+        return {"name": self.name, "seconds": round(self.seconds, 4), "bytes": self.bytes, "rows": self.rows,
+                "peak_rss_mb": self.peak_rss_mb, "profiled": self.profile is not None}
+
+
+class RunReport:
+    """
+    Collects the stages of a run
+    """
+    def __init__(self, profile=None):
+        """
+        :param profile: The names of the stages to run under cProfile, or ["all"]
+        """
+        self.profile = set(profile or [])
+        self.stages = []
+        self.started = datetime.datetime.now()
+        self.start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Time a stage:
+            with run.stage("parse") as stage:
+                ...
+                stage.rows = count
+        :param name:
+        :return:
+        """
+        stage = Stage(name)
+        profiler = None
+        if name in self.profile or "all" in self.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield stage
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                stage.profile = profiler
+            stage.seconds = time.perf_counter() - start
+            stage.peak_rss_mb = peak_rss_mb()
+            self.stages.append(stage)
+            print("{0} took {1:.3f}s".format(name, stage.seconds))
+
+    def as_dict(self, **extra):
+        """
+        :param extra: Anything else to put in the report, like the survey id
+        :return:
+        The report as a dictionary
+        """
+        report = {"started": self.started.isoformat(timespec="seconds"),
+                  "seconds": round(time.perf_counter() - self.start, 4),
+                  "peak_rss_mb": peak_rss_mb(),
+                  "stages": [stage.as_dict() for stage in self.stages]}
+        report.update(extra)
+        return report
+
+    def write(self, path, **extra):
+        """
+        Save the report as JSON. The profile of each profiled stage is saved next to it as <path>_<stage>.prof, which
+        can be opened with pstats or snakeviz, and the top functions are printed.
+        :param path:
+        :param extra: Anything else to put in the report
+        :return:
+        """
+        try:
+            with io.open(path, "w", encoding="utf-8") as f:
+                json.dump(self.as_dict(**extra), f, indent=2)
+            for stage in self.stages:
+                if stage.profile is None:
+                    continue
+                profile_path = os.path.splitext(path)[0] + "_" + stage.name.replace(" ", "_") + ".prof"
+                import pstats
+                stats = pstats.Stats(stage.profile)
+                stats.dump_stats(profile_path)
+                print("Profile of " + stage.name + " saved to " + profile_path)
+                stats.sort_stats("cumulative").print_stats(15)
+        except OSError:
+            print("Failed to write run report " + path + ".")
+            raise
+        print("Run report saved to " + path)
@@ -0,0 +1,221 @@
+# Python 3
+"""
+Parse a very large extracted export on every core.
+
+The export is memory mapped and split into byte ranges that each start and end on a row boundary. A newline only
+ends a row when it is outside of quotes, and comments can hold newlines, so a boundary is a newline with an even
+number of quote characters before it (an escaped quote is two quotes, so it doesn't change the count). Each range
+is parsed in its own process into a partial state, which holds the per student and per reviewer records of just
+that range. The partial states are merged in file order, so the result is the same as parsing the file in one go.
+"""
+
+import concurrent.futures
+import csv
+import itertools
+import mmap
+import os
+
+import survey_response
+
+# Exports smaller than this are parsed in this process, starting workers would take longer than parsing
+MIN_PARALLEL_BYTES = 16 * 1024 * 1024
+# How much of the file is copied at a time while counting quotes
+SCAN_CHUNK = 16 * 1024 * 1024
+
+
+def iter_lines(mm, start, end):
+    """
+    The lines of a range of the file, decoded. csv.reader puts rows with quoted newlines back together.
+    :param mm: The memory mapped file
+    :param start:
+    :param end:
+    :return:
+    A generator of lines
+    """
+    mm.seek(start)
+    while mm.tell() < end:
+        yield mm.readline().decode("utf-8")
+
+
+def read_header(mm):
+    """
+    :param mm: The memory mapped file
+    :return:
+    The three header rows, and the offset of the first response
+    """
+    lines = iter_lines(mm, 0, len(mm))
+    # csv.reader only reads the lines it needs, so afterwards the file position is at the start of the responses
+    header = list(itertools.islice(csv.reader(lines), 3))
+    return header, mm.tell()
+
+
+def count_quotes(mm, start, end):
+    """
+    :param mm: The memory mapped file
+    :param start:
+    :param end:
+    :return:
+    The number of quote characters in the range
+    """
+    quotes = 0
+    for position in range(start, end, SCAN_CHUNK):
+        quotes += mm[position:min(position + SCAN_CHUNK, end)].count(b'"')
+    return quotes
+
+
+def row_end(mm, position, quotes):
+    """
+    :param mm: The memory mapped file
+    :param position: An offset inside a row
+    :param quotes: The number of quote characters between the start of the row and position
+    :return:
+    The offset of the next row, or the size of the file if position is in the last row
+    """
+    size = len(mm)
+    # Walk forward to the first newline that isn't inside quotes
+    while True:
+        newline = mm.find(b'\n', position)
+        if newline == -1:
+            return size
+        quotes += count_quotes(mm, position, newline)
+        position = newline + 1
+        if quotes % 2 == 0:
+            return position
+
+
+def split_rows(mm, start, parts):
+    """
+    Split the responses into ranges of about the same size that start and end on a row boundary
+    :param mm: The memory mapped file
+    :param start: The offset of the first response, a row boundary
+    :param parts: How many ranges to make
+    :return:
+    A list of (start, end) offsets
+    """
+    size = len(mm)
+    boundaries = [start]
+    position = start
+    for part in range(1, parts):
+        target = start + (size - start) * part // parts
+        if target <= position:
+            continue
+        position = row_end(mm, target, count_quotes(mm, position, target))
+        if position >= size:
+            break
+        boundaries.append(position)
+    boundaries.append(size)
+    return [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)
+            if boundaries[i] < boundaries[i + 1]]
+
+
+def skip_seen(mm, start, response_id):
+    """
+    Find where the responses after the watermark start. Response ids are long and random, so the first place the id
+    shows up as a whole field is the watermark response.
+    :param mm: The memory mapped file
+    :param start: The offset of the first response
+    :param response_id: The last response the state holds
+    :return:
+    The offset of the response after the watermark, or start if the watermark isn't in the export
+    """
+    needle = response_id.encode("utf-8")
+    position = mm.find(needle, start)
+    while position != -1:
+        end = position + len(needle)
+        if mm[position - 1:position] in (b',', b'"', b'\n') and mm[end:end + 1] in (b',', b'"', b'\r', b'\n'):
+            return row_end(mm, position, count_quotes(mm, start, position))
+        position = mm.find(needle, end)
+    return start
+
+
+def parse_range(path, header, start, end, watermark=(None, None)):
+    """
+    Parse one range of the export into a partial state. Runs in a worker process.
+    :param path: The extracted export
+    :param header: The three header rows
+    :param start:
+    :param end:
+    :param watermark: The last response id and recorded date the state holds, responses up to it are skipped
+    :return:
+    The partial state
+    """
+    state = survey_response.new_state()
+    state["last_response_id"], state["recorded_date"] = watermark
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        survey_response.accumulate_rows(itertools.chain(header, csv.reader(iter_lines(mm, start, end))), state)
+    return state
+
+
+def merge_state(state, partial):
+    """
+    Fold a partial state into the state. Partials have to be merged in file order.
+    :param state: The state, already set up from the header rows
+    :param partial: A state made by parse_range
+    :return:
+    The number of responses that were added
+    """
+    info = state["info"]
+    reviewers = state["reviewers"]
+    for student_id, record in partial["info"].items():
+        info[student_id].merge(record)
+    for reviewer, record in partial["reviewers"].items():
+        if reviewer in reviewers:
+            reviewers[reviewer].merge(record)
+        else:
+            reviewers[reviewer] = record
+    for position, kind in enumerate(partial["numeric"]):
+        if state["numeric"][position] is None:
+            state["numeric"][position] = kind
+
+    added = sum(record.count for record in partial["info"].values())
+    if added:
+        state["last_response_id"] = partial["last_response_id"]
+        state["recorded_date"] = partial["recorded_date"]
+    return added
+
+
+def parse_file_mmap(path, state=None, workers=None):
+    """
+    Collect all of the information from the reviews in the extracted export, parsing parts of it in parallel
+    :param path: The extracted export
+    :param state: A state from an earlier run to fold the reviews into. Everything is parsed fresh without one.
+    :param workers: How many processes to parse with. (Default one per core)
+    :return:
+    The parsed list, the question names and which questions are numeric
+    """
+    if state is None:
+        state = survey_response.new_state()
+    if not os.path.getsize(path):
+        # An empty file can't be memory mapped
+        return survey_response.parse_rows([], state)
+    workers = workers or os.cpu_count() or 1
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        header, start = read_header(mm)
+        # The header rows set up the state: the questions, their kinds and an empty record for every student
+        survey_response.accumulate_rows(header, state)
+        watermark = (state["last_response_id"], state["recorded_date"])
+        if watermark[0] is not None:
+            # Everything after the watermark response is new. Without it in the export, each range skips what the
+            # state holds by date instead.
+            after = skip_seen(mm, start, watermark[0])
+            if after != start:
+                start = after
+                watermark = (None, None)
+                print("Skipping the responses that were already in the state")
+        parts = workers if len(mm) - start >= MIN_PARALLEL_BYTES else 1
+        ranges = split_rows(mm, start, parts)
+
+    added = 0
+    if len(ranges) > 1:
+        print("Parsing " + path + " in " + str(len(ranges)) + " parts")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            partials = pool.map(parse_range, itertools.repeat(path), itertools.repeat(header), *zip(*ranges),
+                                itertools.repeat(watermark))
+            for partial in partials:
+                added += merge_state(state, partial)
+    else:
+        for start, end in ranges:
+            added += merge_state(state, parse_range(path, header, start, end, watermark))
+    print("Added " + str(added) + " responses")
+    parsed_list = survey_response.ParsedList(state, added=added)
+    return parsed_list, state["structure"], survey_response.question_kinds(state)
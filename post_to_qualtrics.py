@@ -1,14 +1,19 @@
-import requests
 import json
 import sys
 import re
 import argparse
 import csv
+import concurrent.futures
 
-# I'm making the bad assumption that the data center won't change.
-# It will, and it will break this tool when it does
-# TODO: make it a commandline argument that defaults to az1
-data_center = "az1"
+from qualtrics_client import QualtricsClient
+
+# The embedded data endpoint is reached through the organization's own subdomain
+organization = "byui"
+
+# A student name in a text roster. The expected format is: "<one or more names>, <name>"
+NAME = re.compile(r'\w+(?:\s+\w+)*\s*, \w+')
+# An embedded data field holding a student, student1, student2, ...
+SLOT = re.compile(r'^student(\d+)$')
 
 
 def get_args(args):
@@ -53,92 +58,264 @@ def get_args(args):
     return api_token, survey_token, location
 
 
+def iter_roster(location):
+    """
+    Stream the student names out of the roster one line at a time
+    :param location: A csv file with the names in the first column (like an attendance sheet), or a text file with
+    one name per line
+    :return:
+    A generator of names
+    """
+    with open(location, 'r', newline='') as file:
+        if location[-4:] == ".csv":
+            for line in file:
+                # Only the first column is wanted, so don't bother splitting the rest of the row.
+                if line[:1] == '"':
+                    end = line.find('"', 1)
+                    if end != -1 and line[end + 1:end + 2] != '"':
+                        name = line[1:end]
+                    else:
+                        # Escaped quotes inside the name, let the csv module deal with it
+                        name = next(csv.reader([line]))[0]
+                else:
+                    name = line.partition(',')[0].rstrip('\r\n')
+                if name and name != 'Name':
+                    yield name
+        else:
+            # The regex handles multi name students. The expected format is: "<one or more names>, <name>"
+            search = NAME.search
+            for line in file:
+                match = search(line)
+                if match:
+                    yield match.group(0)
+                elif line.strip():
+                    print("Skipping line that doesn't look like a name: " + line.strip())
+
+
 def read_file(location):
-    # default value is blank
-    students = []
+    """
+    Read the roster
+    :param location:
+    :return:
+    The alphabetized list of students, without duplicates
+    """
+    try:
+        students = set(iter_roster(location))
+    except IOError:
+        print("Could not read file: " + str(location))
+        sys.exit()
 
-    # Attempt to open data file as a csv file
-    if location[-4:] == ".csv":
-        try:
-            with open(location, 'r') as file:
-                csvfile = csv.reader(file)
-                for studentName in csvfile:
-                    if studentName[0] != 'Name':
-                        students.append(studentName[0])
+    # Alphabetize students
+    return sorted(students)
 
-        except IOError:
-            print("Could not read file: " + str(location))
-            sys.exit()
 
-    # If it isn't a csv file, open it as a text file.
-    else:
-        try:
-            with open(location, 'r') as file:
-                students = file.read().split("\n")
-                for i, s in enumerate(students):
-                    if s.strip():
-                        # The regex handles multi name students. The expected format is: "<one or more names>, <name>"
-                        students.append(re.search('(\w+\s*)+, \w+', s).group(0))
+def get_embedded_data(client, survey_token):
+    """
+    Get the embedded data fields the survey already has
+    :param client:
+    :param survey_token:
+    :return:
+    A dictionary of key to value. None if the survey couldn't be read.
+    """
+    try:
+        getResponse = client.get("surveys/{0}".format(survey_token))
+        if getResponse.status_code != 200:
+            print("Error: Qualtrics responded " + str(getResponse.status_code) + " to reading the survey")
+            return None
+        fields = getResponse.json()['result'].get('embeddedData') or []
+    except Exception as e:
+        print("Error: could not read the existing embedded data: " + str(e))
+        return None
 
-        except IOError:
-            print("Could not read file: " + str(location))
-            sys.exit()
+    existing = {}
+    for field in fields:
+        key = field.get('name', field.get('key'))
+        if key is not None:
+            existing[key] = field.get('defaultValue', field.get('value'))
+    return existing
 
-    # Alphabetize students
-    students.sort()
-    return students
 
+def post_fields(client, survey_token, fields):
+    """
+    Send one batch of embedded data fields
+    :param client:
+    :param survey_token:
+    :param fields: A list of embedded data fields
+    :return:
+    True if Qualtrics accepted them
+    """
+    response = {"embeddedDataFields": fields}
+    try:
+        postResponse = client.post("surveys/{0}/embeddeddatafields".format(survey_token), data=json.dumps(response))
+        responseString = postResponse.json()['meta']
+    except Exception as e:
+        print("Error: " + str(e))
+        return False
+
+    if responseString['httpStatus'] == '200 - OK':
+        return True
+    print("Error: " + responseString['httpStatus'])
+    print("Error message: " + responseString.get('error', {}).get('errorMessage', ''))
+    return False
 
-def send_data(students, survey_token, api_token):
-    length = len(students)
 
-    keys = range(length)
+def send_data(students, survey_token, api_token, client=None, batch_size=100, workers=4, attempts=3,
+              send_all=False):
+    """
+    Send the students to the survey as embedded data, student1 through studentN. Large rosters are sent in batches
+    at the same time, only failed batches are resent, and students the survey already has aren't sent at all.
+    :param students: The sorted list of student names
+    :param survey_token:
+    :param api_token:
+    :param client:
+    :param batch_size: How many students to send per request
+    :param workers: How many batches to send at the same time
+    :param attempts: How many times to try a batch before giving up on it
+    :param send_all: Send every student, even the ones the survey already has
+    :return:
+    True if every student was sent
+    """
+    if client is None:
+        client = QualtricsClient(api_token, organization=organization, pool_size=workers)
 
-    response = {}
+    # Store all students in required format for embedded data
     studentList = []
-    j = 1
+    for j, student in enumerate(students, start=1):
+        studentList.append({"key": "student" + str(j), "value": student, "type": "text"})
 
-    # Store all students in required format for embedded data
-    for i in keys:
-        studentList.append({"key": "student" + str(j), "value": students[i], "type": "text"})
-        j += 1
+    if not send_all:
+        existing = get_embedded_data(client, survey_token)
+        if existing is None:
+            print("Sending every student")
+            existing = {}
+        studentList = [field for field in studentList if existing.get(field['key']) != field['value']]
+        print(str(len(students) - len(studentList)) + " students are already in the survey")
+    return post_batches(client, survey_token, studentList, batch_size, workers, attempts)
 
-    # Prepare it for send off
-    response["embeddedDataFields"] = studentList
-    postSurvey = "https://byui.{0}.qualtrics.com/API/v3/surveys/{1}/embeddeddatafields".format(data_center, survey_token)
 
-    postHeaders = {
-        "x-api-token": api_token,
-        "Content-Type": "application/json"
-    }
+def post_batches(client, survey_token, studentList, batch_size=100, workers=4, attempts=3):
+    """
+    Send embedded data fields in batches at the same time, resending only the batches that failed
+    :param client:
+    :param survey_token:
+    :param studentList: The embedded data fields to send
+    :param batch_size: How many fields to send per request
+    :param workers: How many batches to send at the same time
+    :param attempts: How many times to try a batch before giving up on it
+    :return:
+    True if every field was sent
+    """
+    if not studentList:
+        print("Nothing to send, the embedded data is up to date")
+        return True
 
-    # Send data off and get response
-    postResponse = requests.post(postSurvey, headers=postHeaders, data=json.dumps(response))
+    batches = [studentList[i:i + batch_size] for i in range(0, len(studentList), batch_size)]
+    for attempt in range(attempts):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            sent = list(pool.map(lambda batch: post_fields(client, survey_token, batch), batches))
+        batches = [batch for batch, ok in zip(batches, sent) if not ok]
+        if not batches:
+            break
+        print(str(len(batches)) + " batches failed, trying them again")
 
-    responseString = postResponse.json()['meta']
+    # If successful, say so. If not, say what didn't make it
+    if batches:
+        print("Error: " + str(sum(len(batch) for batch in batches)) + " students could not be submitted")
+        return False
+    print("Successfully submitted embedded data")
+    return True
 
-    # If successful, say so. If not, print error response
-    if responseString['httpStatus'] == '200 - OK':
-        print("Successfully submitted embedded data")
-    else:
-        print("Error: " + responseString['httpStatus'])
-        print("Error message: " + responseString['error']['errorMessage'])
+
+def assign_slots(students, existing):
+    """
+    Give every student a studentNN slot without moving anyone who already has one. Responses that were already
+    recorded point at a slot, so moving a student would give their reviews to someone else.
+    :param students: The sorted list of student names
+    :param existing: The embedded data the survey already has, see get_embedded_data
+    :return:
+    The embedded data fields that have to be sent: the new students, in alphabetical order, in the slots after the
+    last one in use
+    """
+    slots = {}
+    for key, value in existing.items():
+        match = SLOT.match(key)
+        if match:
+            slots[int(match.group(1))] = value
+    taken = set(slots.values())
+    new_students = [student for student in students if student not in taken]
+
+    # Students who left the class keep their slot, their reviews still point at it
+    roster = set(students)
+    left = sum(1 for student in taken if student and student not in roster)
+    if left:
+        print(str(left) + " students in the survey are no longer in the roster, their slots are kept")
+
+    first = max(slots) + 1 if slots else 1
+    print(str(len(students) - len(new_students)) + " students already have a slot, " + str(len(new_students)) +
+          " new students start at student" + str(first))
+    return [{"key": "student" + str(j), "value": student, "type": "text"}
+            for j, student in enumerate(new_students, start=first)]
+
+
+def sync_data(students, survey_token, client, batch_size=100, workers=4, attempts=3):
+    """
+    Bring the survey's embedded data up to date with the roster, sending only the students who don't have a slot yet
+    :param students: The sorted list of student names
+    :param survey_token:
+    :param client:
+    :param batch_size: How many students to send per request
+    :param workers: How many batches to send at the same time
+    :param attempts: How many times to try a batch before giving up on it
+    :return:
+    True if every new student was sent
+    """
+    existing = get_embedded_data(client, survey_token)
+    if existing is None:
+        # Without the slots already in use every student would be numbered from student1 again, moving the reviews
+        # already recorded onto someone else
+        print("Error: not syncing, the students in the survey are unknown")
+        return False
+    fields = assign_slots(students, existing)
+    return post_batches(client, survey_token, fields, batch_size, workers, attempts)
 
 
 def main(args):
     api_token, survey_token, location = get_args(args)
     students = read_file(location)
-    send_data(students, survey_token, api_token)
+    client = QualtricsClient(api_token, args.dc, organization=organization, base_url=args.url, pool_size=args.workers)
+    if args.sync:
+        sync_data(students, survey_token, client, args.batch, args.workers)
+    else:
+        send_data(students, survey_token, api_token, client, args.batch, args.workers, send_all=args.all)
+    client.print_metrics()
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Send embedded data to a Qualtrics survey')
+def add_arguments(parser):
+    """
+    The arguments for sending a roster
+    :param parser:
+    :return:
+    """
     parser.add_argument('-d', type=str, help='The file where the embedded data is stored. (Required)', required=True)
     parser.add_argument('--s', type=str, help='The survey ID. (Required, or the --f option)')
     parser.add_argument('--t', type=str, help="The API token from Qualtrics. (Required, or the --f option)")
     parser.add_argument('--f', type=str,
                         help='A file that contains the survey ID and the API token separated by newlines.'
                              ' This is for convenience in submitting a survey ID and API Token.')
+    parser.add_argument('--dc', type=str, default='az1', help='The Qualtrics data center. (Default az1)')
+    parser.add_argument('--url', type=str,
+                        help='The base url of the Qualtrics API, overrides --dc. Ex https://byui.az1.qualtrics.com/API/v3/')
+    parser.add_argument('--batch', type=int, default=100, help='How many students to send per request. (Default 100)')
+    parser.add_argument('--workers', type=int, default=4, help='How many requests to send at once. (Default 4)')
+    parser.add_argument('--all', action='store_true',
+                        help='Send every student, even the ones the survey already has.')
+    parser.add_argument('--sync', action='store_true',
+                        help="Keep the students the survey already has in their slots and add new students after "
+                             "them, so responses already recorded still point at the right student.")
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Send embedded data to a Qualtrics survey')
+    add_arguments(parser)
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,179 @@
+# Python 3
+"""
+A small Qualtrics API client shared by post_to_qualtrics.py and survey_response.py.
+
+Every request goes through one keep-alive session, so connections are reused instead of opening a new TLS
+connection per call. Requests time out instead of hanging, are retried when Qualtrics is rate limiting us (429) or
+having trouble (5xx), and the latency of every request is recorded. requests is only imported once the first request
+is sent, so commands that work offline start quickly.
+"""
+
+import random
+import threading
+import time
+
+# Retry these, Qualtrics is either rate limiting us or having a bad moment
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def backoff_delays(initial_delay=0.5, max_delay=10.0):
+    """
+    Generate an endless sequence of jittered, exponentially growing delays
+    :param initial_delay: The first delay, in seconds
+    :param max_delay: The largest delay that will ever be produced, in seconds
+    :return:
+    A generator of delays in seconds
+    """
+    delay = initial_delay
+    while True:
+        # "Equal jitter": keep at least half of the delay so we always back off, randomize the rest so several
+        # requests started at the same moment don't hit the API in lockstep.
+        yield delay / 2 + random.uniform(0, delay / 2)
+        delay = min(delay * 2, max_delay)
+
+
+def retry_after(response):
+    """
+    How long the server asked us to wait before trying again
+    :param response:
+    :return:
+    The delay in seconds, or None if the server didn't say
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # It can also be an HTTP date
+    import email.utils
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class QualtricsClient:
+    """
+    A pooled, retrying connection to the Qualtrics API
+    """
+    def __init__(self, api_token=None, data_center="az1", organization=None, base_url=None, timeout=30, retries=5,
+                 pool_size=10):
+        """
+        :param api_token: The token sent with every request, unless a request passes its own
+        :param data_center: The Qualtrics data center, az1 for BYU-I
+        :param organization: The organization id. Some endpoints are reached through <organization>.<data center>
+        :param base_url: Overrides the url built from the data center and organization
+        :param timeout: How many seconds to wait on a single request
+        :param retries: How many times to retry a request that was rate limited or failed on the server
+        :param pool_size: How many connections to keep open, at least the number of concurrent requests
+        """
+        if base_url is None:
+            host = data_center if organization is None else organization + "." + data_center
+            base_url = "https://{0}.qualtrics.com/API/v3/".format(host)
+        self.base_url = base_url.rstrip("/") + "/"
+        self.api_token = api_token
+        self.timeout = timeout
+        self.retries = retries
+        # One entry per request: method, path, status (None if there was no response) and seconds taken
+        self.metrics = []
+        self.pool_size = pool_size
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """
+        The keep-alive session, made when it is first needed
+        :return:
+        """
+        with self._session_lock:
+            if self._session is None:
+                import requests.adapters
+                self._session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                self._session.mount("https://", adapter)
+                self._session.mount("http://", adapter)
+            return self._session
+
+    def request(self, method, path, api_token=None, **kwargs):
+        """
+        Send a request, retrying on 429 and 5xx responses and on connection errors
+        :param method: GET, POST, PUT...
+        :param path: The endpoint, relative to the base url
+        :param api_token: Overrides the client's token for this request
+        :param kwargs: Anything else requests accepts, like data or stream
+        :return:
+        The response. If every retry failed, the last response is returned so the caller can report the error.
+        """
+        url = self.base_url + path.lstrip("/")
+        headers = {
+            "content-type": "application/json",
+            "x-api-token": api_token or self.api_token,
+            "Cache-Control": 'no-cache'
+        }
+        headers.update(kwargs.pop("headers", {}))
+        kwargs.setdefault("timeout", self.timeout)
+
+        session = self.session
+        import requests
+        delays = backoff_delays()
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = session.request(method, url, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self.metrics.append((method, path, None, time.perf_counter() - start))
+                if attempt >= self.retries:
+                    print("Could not reach " + url)
+                    raise
+                time.sleep(next(delays))
+                attempt += 1
+                continue
+            self.metrics.append((method, path, response.status_code, time.perf_counter() - start))
+
+            if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                return response
+            delay = retry_after(response)
+            # Always move the backoff along, and use it when the server doesn't ask for a particular delay
+            backoff = next(delays)
+            print("Qualtrics responded " + str(response.status_code) + ", retrying")
+            response.close()
+            time.sleep(backoff if delay is None else delay)
+            attempt += 1
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def summary(self):
+        """
+        Summarize the recorded requests
+        :return:
+        A dictionary with the number of requests, how many failed or were retried, and latency statistics in seconds
+        """
+        latencies = sorted(seconds for method, path, status, seconds in self.metrics)
+        if not latencies:
+            return {"requests": 0}
+        failed = sum(1 for method, path, status, seconds in self.metrics if status is None or status >= 400)
+        return {"requests": len(latencies),
+                "failed": failed,
+                "avg": sum(latencies) / len(latencies),
+                "p50": latencies[len(latencies) // 2],
+                "p95": latencies[int(len(latencies) * 0.95)],
+                "max": latencies[-1]}
+
+    def print_metrics(self):
+        """
+        Print how many requests were made and how long they took
+        :return:
+        """
+        summary = self.summary()
+        if not summary["requests"]:
+            return
+        print("Requests: {requests}, failed or retried: {failed}, latency avg {avg:.3f}s, p50 {p50:.3f}s, "
+              "p95 {p95:.3f}s, max {max:.3f}s".format(**summary))
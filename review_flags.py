@@ -0,0 +1,141 @@
+# Python 3
+"""
+Flags reviews and students that a person should look at.
+
+Everything is worked out from what was collected while the export was read: the running counts, means and variances
+of every student and every reviewer. The export is never read a second time. A value is flagged when it is more than
+a few standard deviations from the rest of the class, or when a reviewer reviewed the same student more than once.
+"""
+
+import csv
+import io
+
+from student_record import RunningStats
+
+# How many standard deviations from the class is unusual
+Z_THRESHOLD = 3.0
+# A reviewer needs at least this many scores before giving every one the same value stands out
+SAME_SCORE_MIN = 8
+HEADING = ["Kind", "Who", "About", "Value", "Z", "Reason"]
+
+
+def student_name(record):
+    return record.last + ", " + record.first
+
+
+def unusual(stats, value, threshold):
+    """
+    :param stats: RunningStats of the class
+    :param value:
+    :param threshold:
+    :return:
+    The z-score of value, rounded, if it is past the threshold, otherwise None
+    """
+    z = stats.z_score(value)
+    if z is None or abs(z) <= threshold:
+        return None
+    return round(z, 2)
+
+
+def student_flags(state, threshold=Z_THRESHOLD):
+    """
+    Students with far more reviews than the rest of the class, averages far from the class and reviewers that
+    disagree about them far more than usual
+    :param state: A parse state, see survey_response.new_state
+    :param threshold:
+    :return:
+    A list of flag rows
+    """
+    flags = []
+    reviewed = [record for record in state["info"].values() if record.count]
+
+    counts = RunningStats()
+    for record in reviewed:
+        counts.add(record.count)
+    for record in reviewed:
+        z = unusual(counts, record.count, threshold)
+        if z is not None and z > 0:
+            flags.append(["student", student_name(record), "Reviewed Count", record.count, z,
+                          "Reviewed far more often than the rest of the class"])
+
+    for position, (key, is_numeric) in enumerate(zip(state["structure"], state["numeric"])):
+        if not is_numeric:
+            continue
+        scored = [(record, record.stats(position)) for record in reviewed if record.counts[position]]
+        averages = RunningStats()
+        spreads = RunningStats()
+        for record, stats in scored:
+            averages.add(stats.mean)
+            if stats.n > 1:
+                spreads.add(stats.std())
+        for record, stats in scored:
+            z = unusual(averages, stats.mean, threshold)
+            if z is not None:
+                flags.append(["student", student_name(record), str(key) + " avg", round(stats.mean, 2), z,
+                              "Average is far " + ("above" if z > 0 else "below") + " the class"])
+            if stats.n > 1:
+                z = unusual(spreads, stats.std(), threshold)
+                if z is not None and z > 0:
+                    flags.append(["student", student_name(record), str(key) + " std", round(stats.std(), 2), z,
+                                  "Reviewers disagree far more than usual"])
+    return flags
+
+
+def reviewer_flags(state, threshold=Z_THRESHOLD):
+    """
+    Reviewers that reviewed the same student more than once, scored far from the other reviewers, or gave every
+    score the same value
+    :param state: A parse state, see survey_response.new_state
+    :param threshold:
+    :return:
+    A list of flag rows
+    """
+    flags = []
+    info = state["info"]
+    reviewers = state["reviewers"]
+
+    means = RunningStats()
+    for record in reviewers.values():
+        if record.scores.n:
+            means.add(record.scores.mean)
+
+    for reviewer, record in reviewers.items():
+        for student_id, times in record.students.items():
+            if times > 1:
+                flags.append(["reviewer", reviewer, student_name(info[student_id]), times, "",
+                              "Reviewed the same student more than once"])
+        if not record.scores.n:
+            continue
+        z = unusual(means, record.scores.mean, threshold)
+        if z is not None:
+            flags.append(["reviewer", reviewer, "Average score", round(record.scores.mean, 2), z,
+                          "Scores far " + ("higher" if z > 0 else "lower") + " than the other reviewers"])
+        if record.scores.n >= SAME_SCORE_MIN and record.scores.m2 == 0:
+            flags.append(["reviewer", reviewer, "Every score", record.scores.mean, "",
+                          "Gave every score the same value"])
+    return flags
+
+
+def find_flags(state, threshold=Z_THRESHOLD):
+    """
+    :param state: A parse state, see survey_response.new_state
+    :param threshold: How many standard deviations from the class is unusual
+    :return:
+    A list of flag rows, students first
+    """
+    return student_flags(state, threshold) + reviewer_flags(state, threshold)
+
+
+def write_flags(output_file, flags):
+    """
+    :param output_file: Where to write the flags
+    :param flags: Flag rows, see find_flags
+    :return:
+    The number of flags written
+    """
+    print("Writing " + str(len(flags)) + " flagged reviews and students to " + output_file + ".")
+    with io.open(output_file, "w", encoding="utf-8") as f:
+        wr = csv.writer(f, delimiter=',', dialect='excel', lineterminator='\n')
+        wr.writerow(HEADING)
+        wr.writerows(flags)
+    return len(flags)
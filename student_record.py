@@ -0,0 +1,251 @@
+# Python 3
+"""
+What is collected about each student while the reviews are read.
+
+A record keeps a running count, sum, minimum, maximum and variance (Welford) of the scores for every question, plus
+the answers themselves: the scores already converted to numbers, and the comments as they were written. Reviewers get
+a smaller record of their own. Records use __slots__, so a large class doesn't pay for a dictionary per student.
+"""
+
+import array
+import math
+
+
+def to_number(value):
+    """
+    Scores are usually whole numbers, but sliders can be set to allow decimals
+    :param value:
+    :return:
+    The number
+    :raises ValueError: If the value isn't a number (or is blank)
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+class RunningStats:
+    """
+    Count, mean and variance of a stream of numbers, updated one number at a time (Welford)
+    """
+    __slots__ = ("n", "mean", "m2")
+
+    def __init__(self, n=0, mean=0.0, m2=0.0):
+        self.n = n
+        self.mean = mean
+        # Sum of squared differences from the mean
+        self.m2 = m2
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        """
+        Combine with the stats of another stream (Chan et al.), as if every number had been added here
+        :param other: RunningStats
+        :return:
+        """
+        n = self.n + other.n
+        if not n:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+
+    def variance(self):
+        """
+        :return:
+        The sample variance, or None with fewer than two numbers
+        """
+        return self.m2 / (self.n - 1) if self.n > 1 else None
+
+    def std(self):
+        variance = self.variance()
+        return math.sqrt(variance) if variance is not None else None
+
+    def z_score(self, value):
+        """
+        :param value:
+        :return:
+        How many standard deviations value is from the mean, or None if there is no spread to measure against
+        """
+        std = self.std()
+        return (value - self.mean) / std if std else None
+
+
+class StudentRecord:
+    """
+    The reviews of one student
+    """
+    __slots__ = ("first", "last", "count", "counts", "sums", "m2s", "mins", "maxs", "answers")
+
+    def __init__(self, questions):
+        """
+        :param questions: The number of questions in the survey
+        """
+        self.first = ''
+        self.last = ''
+        # Count the number of times a student has been rated to catch suspiciously high number of reviews.
+        self.count = 0
+        self.counts = array.array('l', [0] * questions)
+        self.sums = array.array('d', [0.0] * questions)
+        # Sum of squared differences from the mean, for the variance
+        self.m2s = array.array('d', [0.0] * questions)
+        self.mins = array.array('d', [math.inf] * questions)
+        self.maxs = array.array('d', [-math.inf] * questions)
+        # One list per question. Scores are stored as numbers, comments as strings.
+        self.answers = [[] for _ in range(questions)]
+
+    def add(self, position, answer, is_numeric=None):
+        """
+        Add one answer
+        :param position: Which question it answers
+        :param answer: The answer as it is in the export
+        :param is_numeric: What kind of question it is, if already known. Answers to free text questions are always
+        kept as text, even when someone writes a number.
+        :return:
+        True if it was a score, False if it was a comment, None if it was left blank
+        """
+        if is_numeric is not False:
+            try:
+                number = to_number(answer)
+            except ValueError:
+                pass
+            else:
+                self.answers[position].append(number)
+                count = self.counts[position]
+                mean = self.sums[position] / count if count else 0.0
+                self.counts[position] = count + 1
+                self.sums[position] += number
+                self.m2s[position] += (number - mean) * (number - self.sums[position] / (count + 1))
+                if number < self.mins[position]:
+                    self.mins[position] = number
+                if number > self.maxs[position]:
+                    self.maxs[position] = number
+                return True
+        # Catch those that are strings, but ignore blank strings
+        if answer.strip():
+            self.answers[position].append(answer)
+            return False
+        return None
+
+    def average(self, position):
+        """
+        :param position:
+        :return:
+        The average score for the question, rounded to two places, or None if there are no scores
+        """
+        if not self.counts[position]:
+            return None
+        return round(self.sums[position] / self.counts[position], 2)
+
+    def stats(self, position):
+        """
+        :param position:
+        :return:
+        RunningStats of the scores for the question
+        """
+        count = self.counts[position]
+        return RunningStats(count, self.sums[position] / count if count else 0.0, self.m2s[position])
+
+    def merge(self, other):
+        """
+        Add the reviews collected in another record of the same student, for example by another worker. The other
+        record's answers go after this one's.
+        :param other: StudentRecord
+        :return:
+        """
+        if not self.first and not self.last:
+            self.first = other.first
+            self.last = other.last
+        self.count += other.count
+        for position in range(len(self.answers)):
+            stats = self.stats(position)
+            stats.merge(other.stats(position))
+            self.counts[position] = stats.n
+            self.sums[position] += other.sums[position]
+            self.m2s[position] = stats.m2
+            self.mins[position] = min(self.mins[position], other.mins[position])
+            self.maxs[position] = max(self.maxs[position], other.maxs[position])
+            self.answers[position] += other.answers[position]
+
+    def to_dict(self):
+        """
+        :return:
+        The record as something json can save
+        """
+        return {"first": self.first, "last": self.last, "count": self.count, "counts": list(self.counts),
+                "sums": list(self.sums), "m2s": list(self.m2s), "mins": list(self.mins), "maxs": list(self.maxs),
+                "answers": self.answers}
+
+    @classmethod
+    def from_dict(cls, saved):
+        """
+        :param saved: A dictionary made by to_dict
+        :return:
+        The record
+        """
+        record = cls(len(saved["answers"]))
+        record.first = saved["first"]
+        record.last = saved["last"]
+        record.count = saved["count"]
+        record.counts = array.array('l', saved["counts"])
+        record.sums = array.array('d', saved["sums"])
+        record.m2s = array.array('d', saved["m2s"])
+        record.mins = array.array('d', saved["mins"])
+        record.maxs = array.array('d', saved["maxs"])
+        record.answers = saved["answers"]
+        return record
+
+
+class ReviewerRecord:
+    """
+    What one reviewer did: how many reviews they wrote, who they reviewed and the spread of the scores they gave
+    """
+    __slots__ = ("count", "students", "scores")
+
+    def __init__(self):
+        self.count = 0
+        # Student id to how many times this reviewer reviewed them
+        self.students = {}
+        self.scores = RunningStats()
+
+    def add(self, student_id, scores):
+        """
+        Add one review
+        :param student_id: Who was reviewed
+        :param scores: The scores given
+        :return:
+        """
+        self.count += 1
+        self.students[student_id] = self.students.get(student_id, 0) + 1
+        for score in scores:
+            self.scores.add(score)
+
+    def merge(self, other):
+        """
+        Add the reviews collected in another record of the same reviewer
+        :param other: ReviewerRecord
+        :return:
+        """
+        self.count += other.count
+        for student_id, times in other.students.items():
+            self.students[student_id] = self.students.get(student_id, 0) + times
+        self.scores.merge(other.scores)
+
+    def to_dict(self):
+        return {"count": self.count, "students": self.students,
+                "scores": [self.scores.n, self.scores.mean, self.scores.m2]}
+
+    @classmethod
+    def from_dict(cls, saved):
+        record = cls()
+        record.count = saved["count"]
+        record.students = saved["students"]
+        record.scores = RunningStats(*saved["scores"])
+        return record
@@ -0,0 +1,135 @@
+# Python 3
+"""
+Get and parse the results of many surveys at once, for example every section of a course.
+
+The surveys are listed in a manifest, a csv file with one survey per line:
+    survey id, API token, name
+The API token may be left out when --t is given, and the name may be left out, the survey id is used instead.
+Every survey gets its own directory under --o with the same files survey_response.py makes.
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import io
+import os
+import sys
+import zipfile
+
+import survey_response
+import table_output
+from instrumentation import RunReport
+from qualtrics_client import QualtricsClient
+
+
+def read_manifest(manifest, default_token=None):
+    """
+    Read the list of surveys to process
+    :param manifest: The path of the manifest
+    :param default_token: The API token for surveys that don't list their own
+    :return:
+    A list of (survey id, API token, name)
+    """
+    sections = []
+    try:
+        with io.open(manifest, 'r', encoding="utf-8", newline='') as f:
+            for line in csv.reader(f):
+                line = [cell.strip() for cell in line]
+                # Survey ids start with SV. Skip anything else, like blank lines, comments or a header.
+                if not line or line[0][0:2] != "SV":
+                    continue
+                survey_token = line[0]
+                api_token = line[1] if len(line) > 1 and line[1] else default_token
+                name = line[2] if len(line) > 2 and line[2] else survey_token
+                if api_token is None:
+                    print("No API token for survey " + survey_token + ", skipping it")
+                    continue
+                sections.append((survey_token, api_token, name))
+    except IOError:
+        print("Could not read manifest " + str(manifest))
+        sys.exit()
+    return sections
+
+
+def main(args):
+    if args.tables and not table_output.load_pyarrow():
+        print("Writing " + args.tables + " tables needs pyarrow. Install it with pip install pyarrow")
+        sys.exit()
+    sections = read_manifest(args.manifest, args.t)
+    if not sections:
+        print("No surveys in " + str(args.manifest))
+        sys.exit()
+    survey_response.make_directory(args.o)
+
+    print("Downloading " + str(len(sections)) + " surveys")
+    api_tokens = {survey_token: api_token for survey_token, api_token, name in sections}
+    client = QualtricsClient(data_center=args.dc, base_url=args.url, pool_size=args.concurrency)
+    downloads = survey_response.download_files(api_tokens, list(api_tokens), args.timeout, args.concurrency, client)
+
+    # Parsing is CPU bound, so every survey is parsed in its own process. Each survey is extracted into its own
+    # directory, nothing depends on the working directory.
+    jobs = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.processes) as pool:
+        for survey_token, api_token, name in sections:
+            downloaded_file = downloads[survey_token]
+            if isinstance(downloaded_file, Exception):
+                print("Failed to download survey " + survey_token + ": " + str(downloaded_file))
+                continue
+            directory = os.path.join(args.o, name)
+            run = RunReport(args.profile)
+            try:
+                survey_response.make_directory(directory)
+                with run.stage("unzip") as stage:
+                    zip_file, zip_path = survey_response.unzip_file(downloaded_file, directory)
+                    stage.bytes = zip_file.infolist()[0].compress_size
+                with run.stage("rename"):
+                    file_name, file_name_date = survey_response.rename_zipped(zip_file, directory)
+            except (OSError, zipfile.BadZipFile, IndexError) as e:
+                # One broken export shouldn't stop the rest of the batch
+                print("Failed to extract survey " + name + ": " + str(e))
+                continue
+            # The surveys are already spread over the processes, so the mmap engine parses each one in its own
+            # process instead of starting a pool per survey
+            job = pool.submit(survey_response.parse_file, os.path.join(directory, file_name_date), args.engine,
+                              None, 1)
+            jobs[job] = (survey_token, name, directory, file_name, run)
+
+        for job in concurrent.futures.as_completed(jobs):
+            survey_token, name, directory, file_name, run = jobs[job]
+            try:
+                # The parse ran in another process, this only waits for it
+                with run.stage("parse") as stage:
+                    parsed_list, structure, numeric = job.result()
+                    stage.rows = parsed_list.added
+            except Exception as e:
+                print("Failed to parse survey " + name + ": " + str(e))
+                continue
+            survey_response.write_reports(run, parsed_list, structure, numeric, directory, file_name, survey_token,
+                                          args, name=name)
+            run.write(os.path.join(directory, file_name + '_' + survey_response.date_stamp() + '_run.json'),
+                      survey=survey_token)
+            print("Finished " + name)
+    client.print_metrics()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Get and parse the results of many Qualtrics surveys at once')
+    parser.add_argument('manifest', type=str,
+                        help='A csv file listing the surveys, one "survey id, API token, name" per line.')
+    parser.add_argument('--t', type=str, help="The API token for surveys that don't list one in the manifest.")
+    parser.add_argument('--o', type=str, default='.', help='Where to put the survey directories. (Default .)')
+    parser.add_argument('--dc', type=str, default='az1', help='The Qualtrics data center. (Default az1)')
+    parser.add_argument('--url', type=str,
+                        help='The base url of the Qualtrics API, overrides --dc. Ex https://az1.qualtrics.com/API/v3/')
+    parser.add_argument('--timeout', type=float, default=600,
+                        help='How many seconds to wait for Qualtrics to prepare each export. (Default 600)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='How many requests to Qualtrics may be in flight at once. (Default 8)')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='How many surveys to parse at the same time. (Default one per core)')
+    parser.add_argument('--engine', type=str, choices=['rows', 'columnar', 'mmap'], default='rows',
+                        help='How to parse the results. "columnar" is faster on large surveys, "mmap" parses very '
+                             'large exports. (Default rows)')
+    survey_response.add_output_arguments(parser)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,50 @@
+# Python 3
+"""
+The survey command, one entry point for the scripts in this repository:
+
+    survey upload   Send a roster of students to a survey as embedded data (post_to_qualtrics.py)
+    survey export   Download a survey's responses and write the reports (survey_response.py)
+    survey parse    Write the reports from an export that is already on disk, without contacting Qualtrics
+    survey report   Query the history of past surveys (history.py)
+
+A command's module is only imported once the command is known, and the network stack only when a request is sent,
+so --help and the offline commands start quickly.
+"""
+
+import argparse
+import importlib
+import sys
+
+# Command to the module it lives in, the function adding its arguments, the function running it and what it does
+COMMANDS = {
+    "upload": ("post_to_qualtrics", "add_arguments", "main",
+               "Send a roster of students to a survey as embedded data"),
+    "export": ("survey_response", "add_arguments", "main",
+               "Download a survey's responses and write the reports"),
+    "parse": ("survey_response", "add_parse_arguments", "parse_main",
+              "Write the reports from an export that is already on disk, without contacting Qualtrics"),
+    "report": ("history", "add_arguments", "main",
+               "Query the history of past surveys"),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="survey", description='Student presentation reviews on Qualtrics',
+                                     epilog="commands:\n" + "\n".join("  {0:<8}{1}".format(command, description)
+                                                                     for command, (_, _, _, description)
+                                                                     in COMMANDS.items()),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', type=str, choices=sorted(COMMANDS), metavar='command',
+                        help='One of ' + ", ".join(COMMANDS) + '. See survey <command> --help.')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help='The arguments of the command.')
+    args = parser.parse_args(argv)
+
+    module_name, add_arguments, run, description = COMMANDS[args.command]
+    module = importlib.import_module(module_name)
+    command_parser = argparse.ArgumentParser(prog="survey " + args.command, description=description)
+    getattr(module, add_arguments)(command_parser)
+    getattr(module, run)(command_parser.parse_args(args.arguments))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,6 +1,7 @@
 # Python 3
 
-import requests
+import concurrent.futures
+import time
 import zipfile
 import io
 import os
@@ -10,7 +11,30 @@ import csv
 import re
 import argparse
 import errno
+import json
 import shutil
+import tarfile
+import tempfile
+import heapq
+import itertools
+import pickle
+import hashlib
+
+from export_cache import ExportCache, DEFAULT_DIRECTORY as DEFAULT_CACHE
+from export_schema import ExportSchema
+from history import HistoryStore
+from instrumentation import RunReport
+from qualtrics_client import QualtricsClient, backoff_delays
+from review_flags import Z_THRESHOLD, find_flags, write_flags
+from student_record import ReviewerRecord, StudentRecord
+import table_output
+
+# Saved states from other versions can't be folded into
+STATE_VERSION = 4
+# The hashes of the student files written to a survey directory
+REPORT_MANIFEST = ".report_hashes.json"
+# How many parsed rows are sorted in memory before sorting spills to temporary files
+SORT_IN_MEMORY = 100000
 
 
 def read_args(args):
@@ -28,6 +52,8 @@ def read_args(args):
     if args.s is not None and args.t is not None:
         survey_token = str(args.s)
         api_token = str(args.t)
+    elif getattr(args, 'offline', False) and args.s is not None:  # Working from the cache, no token needed
+        survey_token = str(args.s)
     elif args.f is not None:  # Read in the information from the file
         try:
             with open(args.f, 'r') as tfile:
@@ -51,79 +77,299 @@ def read_args(args):
     return api_token, survey_token
 
 
-def download_file(api_token, survey_token):
+def create_export(client, survey_token, last_response_id=None, api_token=None):
+    """
+    Ask Qualtrics to start building an export of the survey results
+    :param client: A QualtricsClient
+    :param survey_token:
+    :param last_response_id: Only export the responses recorded after this one
+    :param api_token: Overrides the client's API token
+    :return:
+    The id used to check on the progress of the export
+    """
+    payload = {"format": "csv", "surveyId": survey_token}
+    if last_response_id:
+        payload["lastResponseId"] = last_response_id
+    download_request_response = client.post("responseexports/", data=json.dumps(payload), api_token=api_token)
+    print("Website response: " + str(download_request_response.json()["meta"]["httpStatus"]))
+    return download_request_response.json()["result"]["id"]
+
+
+def check_export(client, progress_id, api_token=None):
+    """
+    Check once on the progress of an export
+    :param client:
+    :param progress_id:
+    :param api_token:
+    :return:
+    True if the export is ready to be downloaded, False otherwise
+    """
+    request_check_response = client.get("responseexports/" + progress_id, api_token=api_token)
+    result = request_check_response.json()["result"]
+    request_check_progress = result["percentComplete"]
+    progress_status = result.get("status", "in progress")
+    print("Download is " + str(request_check_progress) + " complete")
+
+    if progress_status == "failed":
+        raise RuntimeError("Qualtrics failed to build export " + str(progress_id))
+    return request_check_progress >= 100 or progress_status == "complete"
+
+
+def fetch_export(client, progress_id, api_token=None):
+    """
+    Start downloading a finished export
+    :param client:
+    :param progress_id:
+    :param api_token:
+    :return:
+    The streamed response holding the zipped file
+    """
+    return client.get("responseexports/" + progress_id + '/file', api_token=api_token, stream=True)
+
+
+def fetch_spooled(client, progress_id, api_token=None):
+    """
+    Download a finished export into a spooled temporary file. The whole body is read here, so the connection goes
+    back to the pool as soon as the transfer is done.
+    :param client:
+    :param progress_id:
+    :param api_token:
+    :return:
+    The spooled zip file, rewound to the start
+    """
+    request_download = fetch_export(client, progress_id, api_token)
+    try:
+        return spool_download(request_download)
+    finally:
+        request_download.close()
+
+
+def wait_for_export(client, progress_id, timeout=600, api_token=None):
+    """
+    Poll the export with backoff until it is ready or the deadline passes
+    :param client:
+    :param progress_id:
+    :param timeout: How many seconds to wait for the export before giving up
+    :param api_token:
+    :return:
+    """
+    deadline = time.monotonic() + timeout
+    for delay in backoff_delays():
+        if check_export(client, progress_id, api_token):
+            return
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print("Export " + str(progress_id) + " did not finish within " + str(timeout) + " seconds.")
+            raise TimeoutError(progress_id)
+        time.sleep(min(delay, remaining))
+
+
+def download_file(api_token, survey_token, timeout=600, client=None, last_response_id=None):
     """
     Download the survey results from Qualtrics
     :param api_token:
     :param survey_token:
+    :param timeout: How many seconds to wait for Qualtrics to build the export
+    :param client: The QualtricsClient to send requests through. A new one is made if this isn't given.
+    :param last_response_id: Only download the responses recorded after this one
     :return:
     A zipped file of the survey results
     """
-    # Setting user Parameters
-    file_format = "csv"
-    # For BYU-I the data center won't change (Questionable assumption. What about online students?)
-    data_center = "az1"
-    # Setting static parameters
-    request_check_progress = 0
-    progress_status = "in progress"
-    base_url = "https://{0}.qualtrics.com/API/v3/responseexports/".format(data_center)
-    headers = {
-        "content-type": "application/json",
-        "x-api-token": api_token,
-        "Cache-Control": 'no-cache'
-        }
+    if client is None:
+        client = QualtricsClient(api_token, pool_size=1)
 
     # Step 1: Creating Data Export
-    download_request_url = base_url
-    download_request_payload = '{"format":"' + file_format + '","surveyId":"' + survey_token + '"}'
-    download_request_response = requests.request("POST", download_request_url, data=download_request_payload, headers=headers)
-    progress_id = download_request_response.json()["result"]["id"]
-    print("Website response: " + str(download_request_response.json()["meta"]["httpStatus"]))
+    progress_id = create_export(client, survey_token, last_response_id, api_token)
 
     # Step 2: Checking on Data Export Progress and waiting until export is ready
-    while request_check_progress < 100 and progress_status is not "complete":
-        request_check_url = base_url + progress_id
-        request_check_response = requests.request("GET", request_check_url, headers=headers)
-        request_check_progress = request_check_response.json()["result"]["percentComplete"]
-        print("Download is " + str(request_check_progress) + " complete")
+    wait_for_export(client, progress_id, timeout, api_token)
 
     # Step 3: Downloading file
-    request_download_url = base_url + progress_id + '/file'
-    request_download = requests.request("GET", request_download_url, headers=headers, stream=True)
+    return fetch_export(client, progress_id, api_token)
+
+
+def get_response_count(client, survey_token, api_token=None):
+    """
+    Ask Qualtrics how many responses the survey has. Much cheaper than an export.
+    :param client:
+    :param survey_token:
+    :param api_token:
+    :return:
+    The number of responses, or None if it couldn't be found out
+    """
+    try:
+        response = client.get("surveys/" + survey_token, api_token=api_token)
+        return response.json()["result"]["responseCounts"]["auditable"]
+    except Exception as e:
+        print("Could not get the response count of " + survey_token + ": " + str(e))
+        return None
+
+
+def cached_download(cache, api_token, survey_token, timeout=600, client=None):
+    """
+    Download the survey results, unless the cache has an export that is still good
+    :param cache: An ExportCache
+    :param api_token:
+    :param survey_token:
+    :param timeout:
+    :param client:
+    :return:
+    The cached export, which can be read like a download
+    """
+    if client is None:
+        client = QualtricsClient(api_token, pool_size=1)
+    cached = cache.get(survey_token)
+    if cached is not None:
+        return cached
+    response_count = get_response_count(client, survey_token, api_token)
+    cached = cache.get(survey_token, response_count)
+    if cached is not None:
+        return cached
+    return cache.put(survey_token, response_count, download_file(api_token, survey_token, timeout, client))
+
 
-    return request_download
+async def download_files_async(api_token, survey_tokens, timeout=600, max_concurrency=8, client=None):
+    """
+    Download the results of many surveys at once. Every export is polled and transferred concurrently, all over one
+    client, so the whole batch takes about as long as the slowest export.
+    :param api_token: The API token for every survey, or a dictionary of survey id to API token
+    :param survey_tokens: A list of survey ids
+    :param timeout: How many seconds to wait for each export
+    :param max_concurrency: How many requests may be in flight at the same time
+    :param client: The QualtricsClient to send requests through. A new one is made if this isn't given.
+    :return:
+    A dictionary of survey id to the spooled zip file, or to the exception raised while downloading it
+    """
+    import asyncio
+    if client is None:
+        client = QualtricsClient(pool_size=max_concurrency)
+    # requests is blocking, so each call runs in a worker thread. The semaphore keeps us from flooding the API.
+    in_flight = asyncio.Semaphore(max_concurrency)
+
+    def token_for(survey_token):
+        return api_token[survey_token] if isinstance(api_token, dict) else api_token
+
+    async def call(func, survey_token, *args):
+        async with in_flight:
+            return await asyncio.to_thread(func, client, *args, api_token=token_for(survey_token))
+
+    async def download(survey_token):
+        progress_id = await call(create_export, survey_token, survey_token)
+        deadline = time.monotonic() + timeout
+        for delay in backoff_delays():
+            if await call(check_export, survey_token, progress_id):
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print("Export for " + str(survey_token) + " did not finish within " + str(timeout) + " seconds.")
+                raise TimeoutError(survey_token)
+            await asyncio.sleep(min(delay, remaining))
+        # The body is read in the worker thread too, so the transfers overlap
+        return await call(fetch_spooled, survey_token, progress_id)
+
+    results = await asyncio.gather(*(download(token) for token in survey_tokens), return_exceptions=True)
+    return dict(zip(survey_tokens, results))
+
+
+def download_files(api_token, survey_tokens, timeout=600, max_concurrency=8, client=None):
+    """
+    Blocking wrapper around download_files_async
+    :param api_token: The API token for every survey, or a dictionary of survey id to API token
+    :param survey_tokens:
+    :param timeout:
+    :param max_concurrency:
+    :param client:
+    :return:
+    A dictionary of survey id to the spooled zip file, or to the exception raised while downloading it
+    """
+    import asyncio
+    return asyncio.run(download_files_async(api_token, survey_tokens, timeout, max_concurrency, client))
+
+
+def spool_download(request_download, chunk_size=64 * 1024, max_memory=8 * 1024 * 1024):
+    """
+    Copy the streamed download into a spooled temporary file one chunk at a time. Small exports stay in memory,
+    anything larger than max_memory rolls over to disk, so the whole zip is never held in RAM.
+    :param request_download:
+    :param chunk_size: How many bytes to read off the connection at a time
+    :param max_memory: How many bytes to keep in memory before spilling to disk
+    :return:
+    The spooled file, rewound to the start
+    """
+    if isinstance(request_download, tempfile.SpooledTemporaryFile):
+        # Already spooled, see fetch_spooled
+        request_download.seek(0)
+        return request_download
+    spooled = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    for chunk in request_download.iter_content(chunk_size=chunk_size):
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
 
 
-def unzip_file(request_download):
+def unzip_file(request_download, directory="."):
     """
     Unzip the file
     :param request_download:
+    :param directory: Where to extract the file to
     :return:
     return the zipped file and the path to it
     """
-    zipped_file = zipfile.ZipFile(io.BytesIO(request_download.content))
-    zip_file_path = zipped_file.extract(zipped_file.namelist()[0])
+    zipped_file = zipfile.ZipFile(spool_download(request_download))
+    zip_file_path = zipped_file.extract(zipped_file.namelist()[0], directory)
     print('Completed unzipping file')
     return zipped_file, zip_file_path
 
 
-def rename_zipped(zipped_file):
+def stream_export(request_download):
+    """
+    Read the survey results straight out of the download without extracting anything to disk
+    :param request_download:
+    :return:
+    The name of the file inside the zip, and an iterator of its csv rows
+    """
+    spooled = spool_download(request_download)
+    zipped_file = zipfile.ZipFile(spooled)
+    filename = zipped_file.namelist()[0]
+
+    def rows():
+        try:
+            # The member is decompressed as it is read, so only one row is in memory at a time.
+            with zipped_file.open(filename) as member:
+                yield from csv.reader(io.TextIOWrapper(member, encoding="utf-8", newline=''))
+        finally:
+            zipped_file.close()
+            spooled.close()
+
+    return filename, rows()
+
+
+def date_stamp():
+    """
+    Today's date the way it is put in file names, day_month_year
+    :return:
+    """
+    date = datetime.date.today()
+    return str(date.day) + '_' + str(date.month) + '_' + str(date.year)
+
+
+def rename_zipped(zipped_file, directory="."):
     """
     Append the current date stamp to the filename to make it a little more unique
     :param zipped_file:
+    :param directory: Where the file was extracted to
     :return:
     The old file name and the new file name.
     """
     # Get the path
     filename = zipped_file.namelist()[0]
-    path = os.path.dirname(os.path.abspath(filename))
+    path = os.path.dirname(os.path.abspath(os.path.join(directory, filename)))
 
     # Remove spaces from the file name
     file_name = os.path.splitext(filename.replace(" ", ""))[0]
 
     # Add a datestamp to the file
-    date = datetime.date.today()
-    date_path = file_name + '_' + str(date.day) + '_' + str(date.month) + '_' + str(date.year) + '.csv'
+    date_path = file_name + '_' + date_stamp() + '.csv'
 
     try:
         # rename the file, overwriting it in the process.
@@ -136,152 +382,474 @@ def rename_zipped(zipped_file):
     return file_name, date_path
 
 
-def parse_file(file_name_date):
+def new_state(survey_token=None):
     """
-    Collect all of the information from the reviews and organize it under the student
-    :param file_name_date:
+    An empty parse state. The state holds everything needed to fold new responses into the results of earlier runs.
+    :param survey_token:
+    :return:
+    """
+    return {
+        "version": STATE_VERSION,
+        "survey": survey_token,
+        "last_response_id": None,  # The watermark, the last response that has been folded in
+        "recorded_date": None,
+        "response_count": None,  # How many responses the survey had at the last export, if it was asked
+        "structure": [],
+        "numeric": [],  # Per question, True for scores, False for free text, None while we can't tell yet
+        "order": [],
+        "info": {},
+        "reviewers": {}  # Reviewer to what they did
+    }
+
+
+def load_state(state_path, survey_token):
+    """
+    Load the state saved by an earlier run, or start a new one
+    :param state_path:
+    :param survey_token:
+    :return:
+    The state
+    """
+    try:
+        with io.open(state_path, 'r', encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        print("No saved state at " + state_path + ", parsing every response")
+        return new_state(survey_token)
+    except (OSError, ValueError):
+        print("Could not read state file " + state_path + ", parsing every response")
+        return new_state(survey_token)
+
+    if state.get("survey") != survey_token:
+        print("State file " + state_path + " belongs to another survey, parsing every response")
+        return new_state(survey_token)
+    if state.get("version") != STATE_VERSION:
+        print("State file " + state_path + " was saved by an older version, parsing every response")
+        return new_state(survey_token)
+    state["info"] = {student_id: StudentRecord.from_dict(saved) for student_id, saved in state["info"].items()}
+    state["reviewers"] = {reviewer: ReviewerRecord.from_dict(saved) for reviewer, saved in state["reviewers"].items()}
+    print("Folding in responses after " + str(state["last_response_id"]))
+    return state
+
+
+def save_state(state, state_path):
+    """
+    Save the state for the next run. It is written to a temporary file first so a crash can't leave half a state.
+    :param state:
+    :param state_path:
+    :return:
+    """
+    tmp_path = state_path + ".tmp"
+    try:
+        saved = dict(state)
+        saved["info"] = {student_id: record.to_dict() for student_id, record in state["info"].items()}
+        saved["reviewers"] = {reviewer: record.to_dict() for reviewer, record in state["reviewers"].items()}
+        with io.open(tmp_path, 'w', encoding="utf-8") as f:
+            json.dump(saved, f)
+        os.replace(tmp_path, state_path)
+    except OSError:
+        print("Failed to save state file " + state_path + ".")
+        raise
+
+
+class Watermark:
+    """
+    Picks out the responses in an export that the state doesn't hold yet. A full export holds the responses that
+    were folded in already. Qualtrics lists them in the order they were recorded, so anything recorded before the
+    watermark was seen and anything recorded after it is new. Responses recorded in the same second as the watermark
+    can only be told apart by coming before or after the watermark response itself, so they are held back until that
+    is known.
+    """
+    def __init__(self, state):
+        """
+        :param state: The state the responses will be folded into
+        """
+        self.response_id = state["last_response_id"]
+        self.recorded_date = state["recorded_date"]
+        self.held = []
+        self.skipped = 0
+
+    def new_responses(self, schema, row):
+        """
+        :param schema: The ExportSchema
+        :param row: A response
+        :return:
+        The responses that can be folded in now, in export order
+        """
+        if self.response_id is None:
+            return (row,)
+        recorded_date = schema.recorded_date(row)
+        if recorded_date and self.recorded_date:
+            if recorded_date < self.recorded_date:
+                self.skipped += 1
+                return ()
+            if recorded_date > self.recorded_date:
+                # Past the watermark. An export of only the newest responses doesn't hold the watermark itself.
+                self.response_id = None
+                new, self.held = self.held + [row], []
+                return new
+        if schema.response_id(row) == self.response_id:
+            # What was held back came before the watermark
+            self.skipped += len(self.held) + 1
+            self.held = []
+            self.response_id = None
+            return ()
+        self.held.append(row)
+        return ()
+
+    def rest(self):
+        """
+        :return:
+        The responses still held back at the end of the export. The watermark never showed up, so they are new.
+        """
+        held, self.held = self.held, []
+        return held
+
+
+def add_response(schema, row, state, touched=None):
+    """
+    Fold one review into the state
+    :param schema: The ExportSchema
+    :param row: A response
+    :param state:
+    :param touched: A set to add the id of the reviewed student to
     :return:
-    The parsed list
     """
-    info = {}
-    parsed_list = []
-    order = []
-    structure = []
+    numeric = state["numeric"]
+    student_id = schema.student_id(row)
+    student = state["info"][student_id]
+    if touched is not None:
+        touched.add(student_id)
+    scores = []
+    for position, answer in enumerate(schema.answers(row)):
+        kind = student.add(position, answer, numeric[position])
+        if numeric[position] is None and kind is not None:
+            # The first answer to a question decides what kind it is
+            numeric[position] = kind
+        if kind:
+            scores.append(student.answers[position][-1])
+
+    # Keep track of the reviewer too, to catch duplicate and lopsided reviews
+    reviewer = schema.reviewer(row)
+    if reviewer is not None:
+        reviewers = state["reviewers"]
+        if reviewer not in reviewers:
+            reviewers[reviewer] = ReviewerRecord()
+        reviewers[reviewer].add(student_id, scores)
 
-    start_student = 14  # This magical number is the number of cells away from the first "studentXX".
-    i = start_student
-    j = 0  # Used in getting data into a position that makes sense.
+    # Count the number of times a student has been rated to catch suspiciously high number of reviews.
+    student.count += 1
+
+    # Move the watermark forward
+    state["last_response_id"] = schema.response_id(row)
+    state["recorded_date"] = schema.recorded_date(row)
+
+
+def accumulate_rows(rows, state, touched=None):
+    """
+    Fold the reviews in the export into the state, organized under the student. Responses the state already holds
+    are skipped, so a full export can be folded into a state as safely as an export of only the newest responses.
+    :param rows: An iterator of csv rows from the survey export, headers included
+    :param state: The state to add to, see new_state
+    :param touched: A set to add the id of every student that got a new review to
+    :return:
+    The number of responses that were added
+    """
+    info = state["info"]
+    order = state["order"]
+    watermark = Watermark(state)
+    schema = None
     r = 0  # Row we currently are on
-    tmp = 0  # Used in getting the number for the student
+    added = 0
+
+    for row in rows:
+        if r == 0:
+            # The first thing we need to do is get the headers, or question names, whatever you want to call it.
+            # Everything else is looked up through the schema from here on.
+            schema = ExportSchema(row)
+            structure = schema.structure
+
+            if state["structure"] and state["structure"] != structure:
+                # The survey questions changed, what was saved can't be combined with this export.
+                print("The survey questions have changed since the state was saved, starting over")
+                info.clear()
+                state["reviewers"].clear()
+                del order[:]
+                state["last_response_id"] = state["recorded_date"] = None
+                watermark = Watermark(state)
+            if state["structure"] != structure or not state.get("numeric"):
+                state["numeric"] = [None] * len(structure)
+            state["structure"] = structure
+            numeric = state["numeric"]
+
+            # Get the student id's and give each one of them a record
+            for student_id in schema.student_ids:
+                if student_id not in info:
+                    info[student_id] = StudentRecord(len(structure))
+                    order.append(student_id)
+        elif r == 2:
+            # The import ids tell us which questions are free text
+            schema.read_import_ids(row)
+            for position, known in enumerate(schema.numeric):
+                if known is not None:
+                    numeric[position] = known
+        elif r >= 3:
+            if r == 3:
+                # The first response also carries everyone's names
+                for student_id, name in zip(schema.student_ids, schema.names(row)):
+                    # Just in case a student id, Ex student1, is actually a blank name.
+                    # This prevents it from breaking and makes it more clear what happened.
+                    # Honestly this should never happen, but it did at least once
+                    name = name if name else "BLANK, BLANK"
+                    # Insert first and last names
+                    info[student_id].first = re.split(", ", name)[1]
+                    info[student_id].last = re.split(", ", name)[0]
+
+            for response in watermark.new_responses(schema, row):
+                add_response(schema, response, state, touched)
+                added += 1
+        r += 1
+
+    for response in watermark.rest():
+        add_response(schema, response, state, touched)
+        added += 1
+    if watermark.skipped:
+        print("Skipped " + str(watermark.skipped) + " responses that were already in the state")
+    return added
+
+
+def question_kinds(state):
+    """
+    Which questions are scores and which are comments. A question nobody answered counts as comments.
+    :param state:
+    :return:
+    A list of booleans, True for the numeric questions
+    """
+    return [known is True for known in state["numeric"]]
+
+
+def iter_summaries(state, students=None):
+    """
+    Turn the collected reviews into a list of counts, averages, comments and scores, one student at a time
+    :param state:
+    :param students: Only these student ids, every student if None
+    :return:
+    A generator of parsed rows, in the order the students are in the survey
+    """
+    info = state["info"]
+    numeric = question_kinds(state)
+
+    for student_id, student in info.items():
+        if students is not None and student_id not in students:
+            continue
+        # Create list of information for writing to file
+        temp_variables = []
+        temp_averages = []
+        temp_strings = []
+        tmp_list = [student.last, student.first]
+
+        for position, is_numeric in enumerate(numeric):
+            if is_numeric:
+                # The scores were converted when they were read, and the average comes from the running sum
+                temp_variables.append(student.answers[position])
+                temp_averages.append(student.average(position))
+            else:
+                # Simply append anything that isn't a list of numbers
+                temp_strings.append(student.answers[position])
+
+        # Count of reviews. This is to catch suspiciously high reviews
+        tmp_list.append(student.count)
+
+        # Total, of the questions the student was scored on
+        tmp_list.append(str(round(sum(average for average in temp_averages if average is not None), 1)))
+
+        # Add the averages
+        tmp_list += [str(average) for average in temp_averages]
+
+        # Add the comments
+        tmp_list += temp_strings
+
+        # Is there really information here?
+        substance = False
+
+        # List of review scores for individual
+        for list_variables in temp_variables:
+            tmp_list.append(list_variables)
+            if len(list_variables) > 0:
+                substance = True
+
+        # Check to see if there is anything in here besides a name.
+        # This avoids students who haven't been reviewed.
+        if substance:
+            yield tmp_list
+
+
+def spill(rows):
+    """
+    Write sorted rows to a temporary file
+    :param rows:
+    :return:
+    The temporary file, rewound
+    """
+    spilled = tempfile.TemporaryFile()
+    for row in rows:
+        pickle.dump(row, spilled, pickle.HIGHEST_PROTOCOL)
+    spilled.seek(0)
+    return spilled
+
+
+def unspill(spilled):
+    """
+    Read the rows back from a file written by spill, closing it at the end
+    :param spilled:
+    :return:
+    """
+    with spilled:
+        while True:
+            try:
+                yield pickle.load(spilled)
+            except EOFError:
+                return
+
+
+def sort_rows(rows, max_in_memory=SORT_IN_MEMORY):
+    """
+    Sort parsed rows by last name. Up to max_in_memory rows are sorted in memory. Past that, sorted runs are written
+    to temporary files and merged, so only one run is ever held in memory.
+    :param rows: An iterator of parsed rows
+    :param max_in_memory: How many rows to hold in memory at once
+    :return:
+    A generator of the sorted rows
+    """
+    runs = []
+    chunk = list(itertools.islice(rows, max_in_memory))
+    while chunk:
+        chunk.sort(key=lambda sort: sort[0])
+        if len(chunk) < max_in_memory and not runs:
+            # Everything fit, no need for temporary files
+            yield from chunk
+            return
+        runs.append(spill(chunk))
+        chunk = list(itertools.islice(rows, max_in_memory))
+    # heapq.merge takes from the earlier run on ties, so the sort stays stable
+    yield from heapq.merge(*[unspill(run) for run in runs], key=lambda sort: sort[0])
+
+
+def replay(spilled):
+    """
+    Read the rows back from a file written by spill, leaving it open. Every reader keeps its own place in the file,
+    so the rows can be read as many times as needed.
+    :param spilled:
+    :return:
+    """
+    position = 0
+    while True:
+        spilled.seek(position)
+        try:
+            row = pickle.load(spilled)
+        except EOFError:
+            return
+        position = spilled.tell()
+        yield row
+
+
+class ParsedList:
+    """
+    The parsed list: one row per reviewed student, sorted by last name. The rows are built from the state and sorted
+    the first time the list is iterated. If there are few enough they are kept in memory, otherwise they are kept in
+    a temporary file, and every later iteration reads them back from there. The state shouldn't change after that.
+    """
+    def __init__(self, state, max_in_memory=SORT_IN_MEMORY, students=None, added=0):
+        self.state = state
+        self.max_in_memory = max_in_memory
+        # Only these student ids, every student if None
+        self.students = students
+        # How many responses the parse that made the list added to the state
+        self.added = added
+        # The sorted rows, a list or a file written by spill. None until the list is first iterated.
+        self.sorted = None
+
+    def __iter__(self):
+        if self.sorted is None:
+            rows = sort_rows(iter_summaries(self.state, self.students), self.max_in_memory)
+            first = list(itertools.islice(rows, self.max_in_memory))
+            # A full first batch means the sort had to spill, the rest would not fit in memory either
+            self.sorted = first if len(first) < self.max_in_memory else spill(itertools.chain(first, rows))
+        if isinstance(self.sorted, list):
+            return iter(self.sorted)
+        return replay(self.sorted)
+
+
+def parse_rows(rows, state=None):
+    """
+    Collect all of the information from the reviews and organize it under the student
+    :param rows: An iterator of csv rows from the survey export, headers included
+    :param state: A state from an earlier run to fold the reviews into. Everything is parsed fresh without one.
+    :return:
+    The parsed list, the question names and which questions are numeric
+    """
+    if state is None:
+        state = new_state()
+    added = accumulate_rows(rows, state)
+    print("Added " + str(added) + " responses")
+    return ParsedList(state, added=added), state["structure"], question_kinds(state)
+
+
+def get_parser(engine, state=None):
+    """
+    Pick the function that turns export rows into the parsed list
+    :param engine: "rows" for the row by row parser, "columnar" for the columnar engine. "mmap" needs the extracted
+    file, see parse_file, so the row parser is used instead.
+    :param state: A saved state the results are folded into, see load_state
+    :return:
+    """
+    if engine == "mmap":
+        print("The mmap engine can only parse an extracted export, using the row parser instead")
+        engine = "rows"
+    if state is not None:
+        if engine != "rows":
+            print("Only the row parser can fold responses into a saved state, using it instead")
+        return lambda rows: parse_rows(rows, state)
+    if engine == "columnar":
+        # Imported here, the columnar engine may pull in NumPy
+        import columnar
+        return columnar.parse_rows_columnar
+    return parse_rows
+
+
+def parse_file(file_name_date, engine="rows", state=None, workers=None):
+    """
+    Collect all of the information from the reviews in the extracted export and organize it under the student
+    :param file_name_date:
+    :param engine: Which parser to use, see get_parser. "mmap" parses parts of the file in parallel processes.
+    :param state: A saved state to fold the reviews into
+    :param workers: How many processes the mmap engine parses with. (Default one per core)
+    :return:
+    The parsed list, the question names and which questions are numeric
+    """
+    if engine == "mmap":
+        # Imported here, it is only needed for very large exports
+        import mmap_parse
+        print("Opening file " + file_name_date + " for parsing")
+        parsed_list, structure, numeric = mmap_parse.parse_file_mmap(file_name_date, state, workers)
+        print("Parsed " + str(file_name_date))
+        return parsed_list, structure, numeric
     try:
-        with io.open(file_name_date, 'r', encoding="utf-8") as f:
+        with io.open(file_name_date, 'r', encoding="utf-8", newline='') as f:
             print("Opening file " + file_name_date + " for parsing")
-            reader = csv.reader(f)
-            for row in reader:
-                if r == 0:
-                    # The first thing we need to do is get the headers, or question names, whatever you want to call it.
-                    # We are assuming the first question after the from studentxx is going to be select student.
-                    # Continue until three before the end. The last three indexes are going to be location data.
-                    while 'student' in str(row[i]):
-                        i += 1
-                    # We have reached the end of the studentxx format. Continue one past that.
-                    i += 1
-                    while i < len(row) - 3:
-                        if '_' in str(row[i]):
-                            structure.append(str(row[i]).split('_')[0])
-                        else:
-                            structure.append(str(row[i]))
-                        i += 1
-
-                    # We now have all of the appropriate headers. Start over at the right place and get the student
-                    # id's.
-                    i = start_student
-                    # Get the student id's and have each one of them be assigned the structure of the info
-                    while i < len(row) - 10:
-                        info[row[i]] = {'first': '', 'last': ''}
-                        for key in structure:
-                            info[row[i]].update({key: []})
-                        info[row[i]].update({'count': 0})
-
-                        order.append(row[i])
-                        i += 1
-                elif r == 3:
-                    # Reset magic number
-                    i = start_student
-                    while i < len(row) - 10:
-                        # Just in case a student id, Ex student1, is actually a blank name.
-                        # This prevents it from breaking and makes it more clear what happened.
-                        # Honestly this should never happen, but it did at least once
-                        if not row[i]:
-                            row[i] = "BLANK, BLANK"
-                        # Insert first and last names
-                        info[order[j]]['first'] = re.split(", ", row[i])[1]
-                        info[order[j]]['last'] = re.split(", ", row[i])[0]
-                        i += 1
-                        j += 1
-                        tmp = i
-                elif r > 3:
-                    # Insert the data from the csv file
-                    i = len(row) - 9
-                    for key in structure:
-                        try:
-                            # Catch those that are integers or floats
-                            float(row[i])
-                            # use -1 as a marker for those who don't leave reviews
-                            info['student' + str(row[tmp])][key].append(row[i] if row[i] else '-1')
-                        except ValueError:
-                            # Catch those that are strings, but ignore blank strings
-                            if row[i].strip():
-                                info['student' + str(row[tmp])][key].append(row[i])
-                        i += 1
-
-                    # Count the number of times a student has been rated to catch suspiciously high number of reviews.
-                    info['student' + str(row[tmp])]['count'] += 1
-                r += 1
-
-            for student in info:
-                # Create list of information for writing to file
-                temp_variables = []
-                temp_averages = []
-                temp_strings = []
-                tmp_list = [info[student]['last'], info[student]['first']]
-
-                for key in structure:
-                    try:
-                        # Attempt to change the first item to an int. If it fails, than we know it isn't a list
-                        # of integers. If it succeeds, than we do know it is a list of integers
-                        int(info[student][key][0])
-                        # If the int is less than zero it means it wasn't entered into the survey and should be ignored.
-                        temp = [int(item) for item in info[student][key] if int(item or -1) >= 0]
-                        temp_variables.append(temp)
-                        average = None
-                        if len(temp) > 0:
-                            average = round(sum(temp) / float(len(temp)), 2)
-                        temp_averages.append(average)
-                    except (ValueError, IndexError) as e:
-                        # Simply append anything that isn't a list of integers
-                        temp_strings.append(info[student][key])
-
-                # Count of reviews. This is to catch suspiciously high reviews
-                tmp_list.append(info[student]['count'])
-
-                # Total
-                tmp_list.append(str(round(sum(temp_averages), 1)))
-
-                # Add the averages
-                tmp_list += [str(average) for average in temp_averages]
-
-                # Add the comments
-                tmp_list += temp_strings
-
-                # Is there really information here?
-                substance = False
-
-                # List of review scores for individual
-                for list_variables in temp_variables:
-                    tmp_list.append(list_variables)
-                    if len(list_variables) > 0:
-                        substance = True
-
-                # Check to see if there is anything in here besides a name.
-                # This avoids students who haven't been reviewed.
-                if substance:
-                    parsed_list.append(tmp_list)
-        f.close()
+            parsed_list, structure, numeric = get_parser(engine, state)(csv.reader(f))
     except OSError:
         print("Failed to open file " + file_name_date + ".")
         raise
 
     print("Parsed " + str(file_name_date))
-    # Sort list
-    parsed_list.sort(key=lambda sort: sort[0])
-    return parsed_list, structure
+    return parsed_list, structure, numeric
 
 
 def make_directory(file_name):
     """
     Make a directory for this survey
-    :param file_name:
+    :param file_name: The path of the directory
     :return:
     """
     try:
@@ -292,83 +860,229 @@ def make_directory(file_name):
             raise
 
 
-def change_directory(file_name, file_name_date):
+def move_to_directory(directory, file_name_date, source_directory="."):
     """
-    Change into this survey directory and move the downloaded file into this directory
-    :param file_name:
+    Move the downloaded file into this survey's directory. The working directory is left alone, so several surveys
+    can be handled at the same time.
+    :param directory: The survey directory
+    :param file_name_date: The extracted file to move, or None if there isn't one
+    :param source_directory: Where the file was extracted to
     :return:
+    The new path of the file, or None
     """
-    print("Entering directory " + str(file_name))
+    if file_name_date is None:
+        # Nothing was extracted (the export was streamed), so there is nothing to move.
+        return None
+    destination = os.path.join(directory, file_name_date)
+    print("Moving " + str(file_name_date) + " into " + str(directory))
     try:
-        # Get directory BEFORE we change directories
-        dir_path = os.path.dirname(os.path.realpath(__file__))
-        # Get the full path to the downloaded file
-        src = os.path.join(dir_path, file_name_date)
-        dst = os.path.join(dir_path, file_name)
-        # Change into the new directory
-        os.chdir(file_name)
         # Move file_name_date into the new directory, overwriting it if it is already there.
-        shutil.move(src, os.path.join(dst, file_name_date))
-    except WindowsError:
-        print("Failed to enter directory. Exiting")
+        shutil.move(os.path.join(source_directory, file_name_date), destination)
+    except OSError:
+        print("Failed to move file into directory. Exiting")
         raise
+    return destination
+
+
+def student_file_name(student):
+    """
+    Each student file is named after them.
+    :param student: A row of the parsed list
+    :return:
+    """
+    return str(student[0]) + "_" + str(student[1]) + ".txt"
+
+
+def render_student_report(student, structure, numeric):
+    """
+    Build the text of a student's file in one piece, so it can be written with a single call
+    :param student: A row of the parsed list
+    :param structure:
+    :param numeric: Which questions are numeric
+    :return:
+    The report
+    """
+    # The row holds 'Last', 'First', 'Reviewed Count' and 'Total', then the averages of the numeric questions, then
+    # the comments of the free text questions, the same layout as all_info_heading
+    averages = 4
+    comments = averages + sum(1 for is_numeric in numeric if is_numeric)
+    # The students name, first then last
+    lines = [str(student[1]) + " " + str(student[0]) + "\n\n",
+             "Score and comments from your presentation:\n\n",
+             "Total: " + str(student[3]) + "\n"]
+    for key, is_numeric in zip(structure, numeric):
+        if is_numeric:
+            average = student[averages]
+            averages += 1
+            lines.append(str(key) + ": " + ("no scores" if average == "None" else str(average)) + "\n")
+        else:
+            lines.append("\n" + str(key) + ": \n")
+            for comment in student[comments]:
+                # Don't put in blank lines.
+                if comment.strip():
+                    lines.append("\t" + str(comment) + "\n")
+            comments += 1
+    return "".join(lines)
+
+
+def load_report_hashes(directory="."):
+    """
+    The manifest of the student files already in the directory
+    :param directory: The survey directory
+    :return:
+    A dictionary of file name to the sha256 of its contents
+    """
+    try:
+        with io.open(os.path.join(directory, REPORT_MANIFEST), 'r', encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError):
+        print("Could not read the report manifest, every student file will be written")
+        return {}
+
+
+def save_report_hashes(hashes, directory="."):
+    """
+    Save the manifest through a temporary file so it is never left half written
+    :param hashes:
+    :param directory: The survey directory
+    :return:
+    """
+    path = os.path.join(directory, REPORT_MANIFEST)
+    with io.open(path + ".tmp", 'w', encoding="utf-8") as f:
+        json.dump(hashes, f)
+    os.replace(path + ".tmp", path)
+
+
+def write_report(student, structure, numeric, directory=".", hashes=None):
+    """
+    Write one student's file, unless it is already there with the same contents. The file is written to a temporary
+    file first and swapped in, so a reader never sees half of a report.
+    :param student: A row of the parsed list
+    :param structure:
+    :param numeric: Which questions are numeric
+    :param directory: The survey directory
+    :param hashes: The report manifest, see load_report_hashes. Updated with the new hash.
+    :return:
+    True if the file was written, False if it was unchanged
+    """
+    name = student_file_name(student)
+    student_file = os.path.join(directory, name)
+    report = render_student_report(student, structure, numeric)
+    digest = hashlib.sha256(report.encode("utf-8")).hexdigest()
+    if hashes is not None and hashes.get(name) == digest and os.path.isfile(student_file):
+        return False
+    try:
+        # io.open because we need the encoding to be utf-8, and io.open allows us to specify it.
+        with io.open(student_file + ".tmp", "w", encoding="utf-8") as file:
+            file.write(report)
+        os.replace(student_file + ".tmp", student_file)
     except OSError:
-        print("Failed to enter directory. Exiting")
+        print("Failed to write student " + student_file + ".")
+        return False
+    if hashes is not None:
+        hashes[name] = digest
+    return True
+
+
+def write_report_archive(archive, parsed_list, structure, numeric):
+    """
+    Write every student's file into one zip or tar archive in a single pass
+    :param archive: The archive path. .zip makes a zip file, .tar, .tar.gz and .tgz make a tar file.
+    :param parsed_list:
+    :param structure:
+    :param numeric: Which questions are numeric
+    :return:
+    """
+    try:
+        if archive.endswith(".zip"):
+            with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zipped:
+                for student in parsed_list:
+                    zipped.writestr(student_file_name(student), render_student_report(student, structure, numeric))
+        else:
+            mode = "w:gz" if archive.endswith((".tar.gz", ".tgz")) else "w"
+            with tarfile.open(archive, mode) as tarred:
+                for student in parsed_list:
+                    report = render_student_report(student, structure, numeric).encode("utf-8")
+                    member = tarfile.TarInfo(student_file_name(student))
+                    member.size = len(report)
+                    member.mtime = time.time()
+                    tarred.addfile(member, io.BytesIO(report))
+    except OSError:
+        print("Failed to write archive " + archive + ".")
         raise
 
 
-def write_student_file(parsed_list, structure):
+def write_student_file(parsed_list, structure, numeric, workers=1, archive=None, directory="."):
     """
-    Write out each students score and feedback into their own file
+    Write out each students score and feedback into their own file. Only files whose contents changed are written.
     :param parsed_list:
+    :param structure:
+    :param numeric: Which questions are numeric
+    :param workers: How many files to write at the same time. Helps a lot on network shares.
+    :param archive: Put all of the files into this zip or tar archive instead
+    :param directory: The survey directory the files (or the archive) go in
     :return:
+    The number of files written
     """
-    student_file = ""
-    # offset for i so we can skip what we have already printed: 'First', 'Last', 'Reviewed Counted', and 'Total'
-    offset = 4
     print("Starting to write individual student files...")
-    for student in parsed_list:
-        try:
-            # Each student file is named after them.
-            student_file = str(student[0]) + "_" + str(student[1]) + ".txt"
-            if not os.path.isfile(student_file):
-                #io.open because we need the encoding to be utf-8, and io.open allows us to specify it.
-                with io.open(student_file, "w", encoding="utf-8") as file:
-                    # The students name, first then last
-                    file.write(str(student[1]) + " " + str(student[0]) + "\n\n")
-                    file.write("Score and comments from your presentation:\n\n")
-                    file.write("Total: " + str(student[3]) + "\n")
-                    for i, key in enumerate(structure):
-                        try:
-                            # Use the same trick used in parse_text to tell the difference
-                            # between the numbers and the comments
-                            float(student[i + offset][0])
-                            file.write(str(key) + ": " + str(student[i + offset]) + "\n")
-                        except ValueError:
-                            # A string, because it's not a float?
-                            file.write("\n" + str(key) + ": \n")
-                            for comment in student[i + offset]:
-                                # Don't put in blank lines.
-                                if comment.strip():
-                                    file.write("\t" + str(comment) + "\n")
-
-        except OSError:
-            print("Failed to write student " + student_file + ".")
-    print("Completed writing individual student files.")
-
-
-def write_all_info(file_name, parsed_list, structure):
-    """
-    Write out all of the students information into one place
+    if archive:
+        write_report_archive(os.path.join(directory, archive), parsed_list, structure, numeric)
+        print("Completed writing individual student files.")
+        return None
+
+    hashes = load_report_hashes(directory)
+    if workers > 1:
+        written = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            # pool.map would take every student up front. Only a few are handed out ahead of the writers, so the
+            # students keep streaming out of parsed_list.
+            pending = set()
+            for student in parsed_list:
+                if len(pending) >= workers * 2:
+                    done, pending = concurrent.futures.wait(pending,
+                                                            return_when=concurrent.futures.FIRST_COMPLETED)
+                    written += [future.result() for future in done]
+                pending.add(pool.submit(write_report, student, structure, numeric, directory, hashes))
+            written += [future.result() for future in pending]
+    else:
+        written = [write_report(student, structure, numeric, directory, hashes) for student in parsed_list]
+    save_report_hashes(hashes, directory)
+    print("Completed writing individual student files. Wrote " + str(sum(written)) + ", " +
+          str(len(written) - sum(written)) + " were unchanged.")
+    return sum(written)
+
+
+def all_info_heading(structure, numeric):
+    """
+    The header of the combined file, in the same order parse_rows lays out each student
+    :param structure:
+    :param numeric: Which questions are numeric
+    :return:
+    """
+    heading = ['Last', 'First', 'Reviewed Count', 'Total']
+    # First the averages, then the comments, then the individual scores again under the plain question name.
+    heading += [str(key) + " avg" for key, is_numeric in zip(structure, numeric) if is_numeric]
+    heading += [str(key) for key, is_numeric in zip(structure, numeric) if not is_numeric]
+    heading += [str(key) for key, is_numeric in zip(structure, numeric) if is_numeric]
+    return heading
+
+
+def write_all_info(file_name, parsed_list, structure, numeric, directory="."):
+    """
+    Write out all of the students information into one place. The rows are written as they come, so parsed_list can
+    be a generator.
     :param file_name:
     :param parsed_list:
+    :param structure:
+    :param numeric: Which questions are numeric
+    :param directory: The survey directory
     :return:
+    The number of students written
     """
-    date = datetime.date.today()
-    output_file = file_name + '_' + str(date.day) + '_' + str(date.month) + '_' + str(date.year) + '_parsed' + '.csv'
-    # This offset allows us to use i and skip 'Last', 'First', 'Reviewed Count', 'Total' which are already in the
-    # header.
-    offset = 4
+    output_file = os.path.join(directory, file_name) + '_' + date_stamp() + '_parsed' + '.csv'
+    written = 0
 
     # Write data to file in readable format.
     try:
@@ -377,62 +1091,232 @@ def write_all_info(file_name, parsed_list, structure):
             print("Writing all student reviews to " + output_file + ".")
             wr = csv.writer(resultFile, delimiter=',', dialect='excel', lineterminator='\n')
 
-            # Set up the header
-            heading = ['Last', 'First', 'Reviewed Count', 'Total']
-
-            # There is two parts to this next part. First we get the headers for the averages and the strings
-            # Then we put in all the same headers for what was averaged but without 'avg' as we are putting in
-            # the individual scores.
-
-            for i, key in enumerate(structure):
-                try:
-                    # Get all of the headers that can be averaged. (The numerical responses)
-                    float(parsed_list[0][i + offset])
-                    heading.append(str(key) + " avg")
-                except (ValueError, TypeError) as e:
-                    # Get all of the string responses
-                    heading.append(str(key))
-
-            for i, key in enumerate(structure):
-                try:
-                    # Get the headers for the individual scores
-                    float(parsed_list[0][i + offset])
-                    heading.append(str(key))
-                except (ValueError, TypeError) as e:
-                    # ignore the strings
-                    continue
-
-            # Write the headers
-            wr.writerow(heading)
+            # The header is known from the questions alone, so it goes first
+            wr.writerow(all_info_heading(structure, numeric))
 
             # Now write a student and all of the associated information
             for student in parsed_list:
                 wr.writerow(student)
+                written += 1
     except PermissionError:
         print("Permission to write denied. " + output_file + " is probably open somewhere.")
     except OSError:
         print("Failed to write file " + output_file + ".")
         raise
+    return written
 
 
 def main(args):
     api_token, survey_token = read_args(args)
-    downloaded_file = download_file(api_token, survey_token)
-    zip_file, zip_path = unzip_file(downloaded_file)
-    file_name, file_name_date = rename_zipped(zip_file)
-    parsed_list, structure, = parse_file(file_name_date)
-    make_directory(file_name)
-    change_directory(file_name, file_name_date)
-    write_student_file(parsed_list, structure)
-    write_all_info(file_name, parsed_list, structure)
+    if args.tables and not table_output.load_pyarrow():
+        print("Writing " + args.tables + " tables needs pyarrow. Install it with pip install pyarrow")
+        sys.exit()
+    run = RunReport(args.profile)
+    state = None
+    last_response_id = None
+    if args.state:
+        state = load_state(args.state, survey_token)
+        last_response_id = state["last_response_id"]
+    client = QualtricsClient(api_token, args.dc, base_url=args.url, pool_size=1)
+    cache = None
+    if args.cache or args.offline:
+        cache = ExportCache(args.cache or DEFAULT_CACHE, args.cache_ttl,
+                            args.cache_size * 1024 * 1024)
+    with run.stage("download"):
+        if args.offline:
+            downloaded_file = cache.get(survey_token, any_age=True)
+            if downloaded_file is None:
+                print("No cached export of " + survey_token + ", it has to be downloaded at least once")
+                sys.exit()
+        elif cache is not None and state is None:
+            downloaded_file = cached_download(cache, api_token, survey_token, args.timeout, client)
+        else:
+            # Exports of only the newest responses aren't cached, they are folded into the state instead
+            downloaded_file = download_file(api_token, survey_token, args.timeout, client, last_response_id)
+    if args.stream:
+        # Parse straight from the download. No copy of the export is kept.
+        with run.stage("stream") as stage:
+            filename, rows = stream_export(downloaded_file)
+            stage.bytes = int(downloaded_file.headers.get("Content-Length", 0)) or None
+        file_name = os.path.splitext(filename.replace(" ", ""))[0]
+        file_name_date = None
+        with run.stage("parse") as stage:
+            parsed_list, structure, numeric = get_parser(args.engine, state)(rows)
+            stage.rows = parsed_list.added
+        print("Parsed " + str(filename))
+    else:
+        with run.stage("unzip") as stage:
+            zip_file, zip_path = unzip_file(downloaded_file)
+            stage.bytes = zip_file.infolist()[0].compress_size
+        with run.stage("rename"):
+            file_name, file_name_date = rename_zipped(zip_file)
+        with run.stage("parse") as stage:
+            parsed_list, structure, numeric = parse_file(file_name_date, args.engine, state)
+            stage.bytes = os.path.getsize(file_name_date)
+            stage.rows = parsed_list.added
+    if state is not None:
+        save_state(state, args.state)
+    with run.stage("directory"):
+        make_directory(file_name)
+        move_to_directory(file_name, file_name_date)
+    write_reports(run, parsed_list, structure, numeric, file_name, file_name, survey_token, args)
+    client.print_metrics()
+    run.write(os.path.join(file_name, file_name + '_' + date_stamp() + '_run.json'), survey=survey_token,
+              requests=client.summary())
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Get and parse data from a Qualtrics survey of students reviews')
+def write_reports(run, parsed_list, structure, numeric, directory, file_name, survey_token, args, students=None,
+                  name=None):
+    """
+    Write everything that comes out of a parsed survey into the survey directory. Every command that writes reports
+    goes through here, see add_output_arguments for the arguments it reads.
+    :param run: The RunReport to record the stages in
+    :param parsed_list:
+    :param structure:
+    :param numeric: Which questions are numeric
+    :param directory: The survey directory
+    :param file_name: The start of every file name in the directory
+    :param survey_token: The survey ID, for the history
+    :param args: The command line arguments
+    :param students: Only write the files of these student ids, the others haven't changed. (Default every student)
+    :param name: What to call the survey in the history. (Default file_name)
+    :return:
+    """
+    output_prefix = os.path.join(directory, file_name) + '_' + date_stamp()
+    changed = parsed_list
+    if students is not None and isinstance(parsed_list, ParsedList) and not args.archive:
+        # An archive is written whole every time, so it still needs every student
+        changed = ParsedList(parsed_list.state, parsed_list.max_in_memory, students)
+    with run.stage("student files") as stage:
+        stage.rows = write_student_file(changed, structure, numeric, args.workers, args.archive, directory)
+    with run.stage("all info") as stage:
+        stage.rows = write_all_info(file_name, parsed_list, structure, numeric, directory)
+    if isinstance(parsed_list, ParsedList):
+        # The columnar engine doesn't keep what the flags are worked out from
+        with run.stage("flags") as stage:
+            stage.rows = write_flags(output_prefix + '_flags.csv', find_flags(parsed_list.state, args.flag_z))
+    if args.tables:
+        with run.stage("tables") as stage:
+            stage.rows = table_output.write_tables(output_prefix, parsed_list, structure, numeric, args.tables)
+    if args.history:
+        with run.stage("history") as stage, HistoryStore(args.history) as store:
+            stage.rows = store.add(survey_token, parsed_list, structure, numeric, name or file_name)
+
+
+def parse_main(args):
+    """
+    Write the reports from an export that is already on disk. Nothing is downloaded.
+    :param args:
+    :return:
+    """
+    if args.tables and not table_output.load_pyarrow():
+        print("Writing " + args.tables + " tables needs pyarrow. Install it with pip install pyarrow")
+        sys.exit()
+    file_name = os.path.splitext(os.path.basename(args.file))[0].replace(" ", "")
+    directory = args.o or file_name
+    survey_token = args.s or file_name
+    run = RunReport(args.profile)
+    state = load_state(args.state, survey_token) if args.state else None
+    with run.stage("parse") as stage:
+        parsed_list, structure, numeric = parse_file(args.file, args.engine, state)
+        stage.bytes = os.path.getsize(args.file)
+        stage.rows = parsed_list.added
+    if state is not None:
+        save_state(state, args.state)
+    with run.stage("directory"):
+        os.makedirs(directory, exist_ok=True)
+    write_reports(run, parsed_list, structure, numeric, directory, file_name, survey_token, args)
+    run.write(os.path.join(directory, file_name + '_' + date_stamp() + '_run.json'), survey=survey_token)
+
+
+def add_report_arguments(parser):
+    """
+    The arguments for parsing and writing the reports, shared by both commands
+    :param parser:
+    :return:
+    """
+    parser.add_argument('--engine', type=str, choices=['rows', 'columnar', 'mmap'], default='rows',
+                        help='How to parse the results. "columnar" is faster on large surveys, "mmap" parses very '
+                             'large exports on every core. (Default rows)')
+    parser.add_argument('--state', type=str,
+                        help='A file to keep the parsed results in between runs. Only responses newer than the last '
+                             'run are downloaded and parsed, and are added to the saved results.')
+    add_output_arguments(parser)
+
+
+def add_output_arguments(parser):
+    """
+    The arguments for what is written from a parsed survey, see write_reports. Shared by every command that writes
+    reports.
+    :param parser:
+    :return:
+    """
+    parser.add_argument('--workers', type=int, default=4,
+                        help='How many student files to write at the same time. (Default 4)')
+    parser.add_argument('--archive', type=str,
+                        help='Write the student files into one zip or tar archive with this name instead.')
+    parser.add_argument('--tables', type=str, choices=sorted(table_output.FORMATS),
+                        help='Also write the averages and every review score as parquet or arrow tables. '
+                             'Needs pyarrow.')
+    parser.add_argument('--history', type=str, metavar='DATABASE',
+                        help='Also save the scores to this SQLite history, see history.py for querying it.')
+    parser.add_argument('--flag-z', type=float, default=Z_THRESHOLD,
+                        help='How many standard deviations from the class a student or reviewer must be to be '
+                             'flagged. (Default ' + str(Z_THRESHOLD) + ')')
+    parser.add_argument('--profile', type=str, nargs='+', metavar='STAGE',
+                        help='Run these stages under cProfile, or "all". The stages are download, stream, unzip, '
+                             'rename, parse, directory, "student files" and "all info".')
+
+
+def add_arguments(parser):
+    """
+    The arguments for downloading a survey and writing the reports
+    :param parser:
+    :return:
+    """
     parser.add_argument('--s', type=str, help='The survey ID. (Required, or the --f option)')
     parser.add_argument('--t', type=str, help="The API token from Qualtrics. (Required, or the --f option)")
     parser.add_argument('--f', type=str,
                         help='A file that contains the survey ID and the API token separated by newlines.'
                              ' This is for convenience in submitting a survey ID and API Token.')
+    parser.add_argument('--dc', type=str, default='az1', help='The Qualtrics data center. (Default az1)')
+    parser.add_argument('--url', type=str,
+                        help='The base url of the Qualtrics API, overrides --dc. Ex https://az1.qualtrics.com/API/v3/')
+    parser.add_argument('--timeout', type=float, default=600,
+                        help='How many seconds to wait for Qualtrics to prepare the export. (Default 600)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Parse the results as they are downloaded instead of extracting the csv file first.')
+    parser.add_argument('--cache', type=str,
+                        help='Keep downloaded exports in this directory and only download again when the survey has '
+                             'new responses.')
+    parser.add_argument('--cache-ttl', type=float, default=3600,
+                        help='How many seconds a cached export is used without checking for new responses. '
+                             '(Default 3600)')
+    parser.add_argument('--cache-size', type=int, default=500,
+                        help='How many MB the cache may use before old exports are dropped. (Default 500)')
+    parser.add_argument('--offline', action='store_true',
+                        help='Parse the cached export without contacting Qualtrics, only --s is needed. Uses '
+                             '--cache, or ' + DEFAULT_CACHE + ' when it is not given.')
+    add_report_arguments(parser)
+
+
+def add_parse_arguments(parser):
+    """
+    The arguments for writing the reports from an export on disk
+    :param parser:
+    :return:
+    """
+    parser.add_argument('file', type=str, help='The csv export from Qualtrics.')
+    parser.add_argument('--s', type=str,
+                        help='The survey ID, used for --state and --history. (Default the name of the file)')
+    parser.add_argument('--o', type=str,
+                        help='The directory to write the reports in. The files in it are still named after the '
+                             'export. (Default the name of the file)')
+    add_report_arguments(parser)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Get and parse data from a Qualtrics survey of students reviews')
+    add_arguments(parser)
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,161 @@
+# Python 3
+"""
+Columnar copies of the combined file, for analytics jobs that load many semesters of reviews at once.
+
+Two tables are written next to the parsed csv: one row per student with the review count, the total and the average
+of every numeric question, and one row per review score. Parquet files are compressed, Arrow IPC files can be memory
+mapped and read without copying. pyarrow is only needed, and only imported, when one of these formats is asked for.
+"""
+
+# Set by load_pyarrow
+pyarrow = None
+
+# File extension of each format
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+# How many students are converted at a time, so large classes are never held in memory twice
+BATCH_STUDENTS = 10000
+
+
+def load_pyarrow():
+    """
+    Import pyarrow the first time it is needed. It takes longer to import than everything else put together.
+    :return:
+    True if pyarrow is installed
+    """
+    global pyarrow
+    if pyarrow is None:
+        try:
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            pyarrow = None
+            return False
+    return True
+
+
+def student_schema(structure, numeric):
+    """
+    :param structure:
+    :param numeric: Which questions are numeric
+    :return:
+    The schema of the per student table, the averages are named the same as in the parsed csv
+    """
+    fields = [("student", pyarrow.int32()), ("last", pyarrow.string()), ("first", pyarrow.string()),
+              ("reviewed_count", pyarrow.int32()), ("total", pyarrow.float64())]
+    fields += [(str(key) + " avg", pyarrow.float64()) for key, is_numeric in zip(structure, numeric) if is_numeric]
+    return pyarrow.schema(fields)
+
+
+def score_schema():
+    """
+    :return:
+    The schema of the per review table. The student column is the row of the student in the per student table.
+    """
+    return pyarrow.schema([("student", pyarrow.int32()), ("question", pyarrow.dictionary(pyarrow.int16(),
+                                                                                            pyarrow.string())),
+                           ("score", pyarrow.float64())])
+
+
+def open_writer(path, schema, table_format):
+    """
+    :param path:
+    :param schema:
+    :param table_format: parquet or arrow
+    :return:
+    A writer with write_batch and close
+    """
+    if table_format == "parquet":
+        return pyarrow.parquet.ParquetWriter(path, schema)
+    return pyarrow.ipc.new_file(path, schema)
+
+
+def to_average(value):
+    """
+    The parsed rows hold the averages as strings, "None" when a question has no scores
+    :param value:
+    :return:
+    """
+    return None if value == "None" else float(value)
+
+
+def write_tables(output_prefix, parsed_list, structure, numeric, table_format="parquet"):
+    """
+    Write the per student and per review tables. The rows are converted in batches as they come, so parsed_list can
+    be a generator.
+    :param output_prefix: The path of the files, without the table name and extension
+    :param parsed_list:
+    :param structure:
+    :param numeric: Which questions are numeric
+    :param table_format: parquet or arrow
+    :return:
+    The number of students written
+    """
+    if not load_pyarrow():
+        raise ImportError("pyarrow is needed to write " + table_format + " files")
+    extension = FORMATS[table_format]
+    questions = [str(key) for key, is_numeric in zip(structure, numeric) if is_numeric]
+    averages = len(questions)
+    comments = len(numeric) - averages
+    # Where the score lists start in a parsed row
+    first_scores = 4 + averages + comments
+
+    students_schema = student_schema(structure, numeric)
+    scores_schema = score_schema()
+    question_names = pyarrow.array(questions, pyarrow.string())
+    students_path = output_prefix + "_students" + extension
+    scores_path = output_prefix + "_scores" + extension
+    print("Writing " + table_format + " tables to " + students_path + " and " + scores_path + ".")
+
+    written = 0
+    students_writer = open_writer(students_path, students_schema, table_format)
+    scores_writer = open_writer(scores_path, scores_schema, table_format)
+    try:
+        batch = []
+        for student in parsed_list:
+            batch.append(student)
+            if len(batch) == BATCH_STUDENTS:
+                write_batch(batch, written, students_writer, scores_writer, students_schema, question_names,
+                            first_scores)
+                written += len(batch)
+                batch = []
+        if batch:
+            write_batch(batch, written, students_writer, scores_writer, students_schema, question_names,
+                        first_scores)
+            written += len(batch)
+    finally:
+        students_writer.close()
+        scores_writer.close()
+    return written
+
+
+def write_batch(batch, offset, students_writer, scores_writer, students_schema, question_names, first_scores):
+    """
+    Convert a batch of parsed rows into one record batch of each table
+    :param batch: Parsed rows
+    :param offset: How many students have already been written
+    :param students_writer:
+    :param scores_writer:
+    :param students_schema:
+    :param question_names: The dictionary of the question column
+    :param first_scores: Where the score lists start in a parsed row
+    :return:
+    """
+    averages = len(question_names)
+    columns = [list(range(offset, offset + len(batch))), [row[0] for row in batch], [row[1] for row in batch],
+               [row[2] for row in batch], [float(row[3]) for row in batch]]
+    columns += [[to_average(row[4 + question]) for row in batch] for question in range(averages)]
+    students_writer.write_batch(pyarrow.record_batch(columns, schema=students_schema))
+
+    score_students = []
+    score_questions = []
+    scores = []
+    for student, row in enumerate(batch, offset):
+        for question in range(averages):
+            values = row[first_scores + question]
+            score_students += [student] * len(values)
+            score_questions += [question] * len(values)
+            scores += values
+    questions = pyarrow.DictionaryArray.from_arrays(pyarrow.array(score_questions, pyarrow.int16()), question_names)
+    scores_writer.write_batch(pyarrow.record_batch([pyarrow.array(score_students, pyarrow.int32()), questions,
+                                                    pyarrow.array(scores, pyarrow.float64())],
+                                                   schema=score_schema()))
@@ -0,0 +1,157 @@
+# Python 3
+"""
+Keep the reports of many surveys up to date while the responses come in.
+
+The surveys are listed in a manifest, the same as for survey_batch.py. Every --interval seconds each survey is
+checked by asking Qualtrics how many responses it has, which is much cheaper than an export. Only when the number
+changes are the responses after the last one seen exported and folded into the survey's saved state. Then only the
+students with new reviews get their files written again, along with the combined csv and the flags. Stop with Ctrl-C.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+import survey_response
+import table_output
+from instrumentation import RunReport
+from qualtrics_client import QualtricsClient
+from survey_batch import read_manifest
+
+
+class WatchedSurvey:
+    """
+    A survey being watched and its saved state
+    """
+    def __init__(self, survey_token, api_token, name, directory):
+        """
+        :param survey_token:
+        :param api_token:
+        :param name: What the survey is called in the manifest
+        :param directory: Where its reports and state are kept
+        """
+        self.survey_token = survey_token
+        self.api_token = api_token
+        self.name = name
+        self.directory = directory
+        self.state_path = os.path.join(directory, name + "_state.json")
+        self.state = survey_response.load_state(self.state_path, survey_token)
+
+    def refresh(self, client, response_count, args):
+        """
+        Export the responses we haven't seen yet and update the reports. This blocks, so it is run in a worker thread.
+        :param client:
+        :param response_count: How many responses the survey has now
+        :param args: The command line arguments, see survey_response.write_reports for the ones about the reports
+        :return:
+        The number of responses that were added
+        """
+        run = RunReport(args.profile)
+        with run.stage("download"):
+            downloaded_file = survey_response.download_file(self.api_token, self.survey_token, args.timeout, client,
+                                                            self.state["last_response_id"])
+        with run.stage("parse") as stage:
+            filename, rows = survey_response.stream_export(downloaded_file)
+            touched = set()
+            added = survey_response.accumulate_rows(rows, self.state, touched)
+            stage.rows = added
+        # The count is saved with the state, so a restart doesn't export a survey that hasn't changed
+        self.state["response_count"] = response_count
+        survey_response.save_state(self.state, self.state_path)
+        if not added:
+            return 0
+
+        structure = self.state["structure"]
+        numeric = survey_response.question_kinds(self.state)
+        file_name = os.path.splitext(filename.replace(" ", ""))[0]
+        # Students without new reviews would get the same file again, so only the touched ones are rendered
+        survey_response.write_reports(run, survey_response.ParsedList(self.state, added=added), structure, numeric,
+                                      self.directory, file_name, self.survey_token, args, students=touched,
+                                      name=self.name)
+        run.write(os.path.join(self.directory, file_name + '_' + survey_response.date_stamp() + '_run.json'),
+                  survey=self.survey_token)
+        print(self.name + ": added " + str(added) + " responses, updated " + str(len(touched)) + " students")
+        return added
+
+
+async def watch_survey(survey, client, in_flight, args):
+    """
+    Check one survey every args.interval seconds, and refresh it when its response count changes
+    :param survey: A WatchedSurvey
+    :param client: The QualtricsClient shared by every survey
+    :param in_flight: Semaphore limiting how many surveys are checked or exported at once
+    :param args:
+    :return:
+    """
+    while True:
+        async with in_flight:
+            count = await asyncio.to_thread(survey_response.get_response_count, client, survey.survey_token,
+                                            survey.api_token)
+            if count is not None and count != survey.state.get("response_count"):
+                try:
+                    await asyncio.to_thread(survey.refresh, client, count, args)
+                except Exception as e:
+                    # Try again at the next check
+                    print("Failed to refresh survey " + survey.name + ": " + str(e))
+        if args.once:
+            return
+        await asyncio.sleep(args.interval)
+
+
+async def watch(surveys, client, args):
+    """
+    Watch every survey at once
+    :param surveys: A list of WatchedSurvey
+    :param client:
+    :param args:
+    :return:
+    """
+    in_flight = asyncio.Semaphore(args.concurrency)
+    await asyncio.gather(*(watch_survey(survey, client, in_flight, args) for survey in surveys))
+
+
+def main(args):
+    if args.tables and not table_output.load_pyarrow():
+        print("Writing " + args.tables + " tables needs pyarrow. Install it with pip install pyarrow")
+        sys.exit()
+    sections = read_manifest(args.manifest, args.t)
+    if not sections:
+        print("No surveys in " + str(args.manifest))
+        sys.exit()
+    surveys = []
+    for survey_token, api_token, name in sections:
+        directory = os.path.join(args.o, name)
+        os.makedirs(directory, exist_ok=True)
+        surveys.append(WatchedSurvey(survey_token, api_token, name, directory))
+    client = QualtricsClient(data_center=args.dc, base_url=args.url, pool_size=args.concurrency)
+
+    print("Watching " + str(len(surveys)) + " surveys, checking every " + str(args.interval) + " seconds")
+    try:
+        asyncio.run(watch(surveys, client, args))
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    client.print_metrics()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Keep the reports of Qualtrics surveys up to date as responses '
+                                                 'come in')
+    parser.add_argument('manifest', type=str,
+                        help='A csv file listing the surveys, one "survey id, API token, name" per line.')
+    parser.add_argument('--t', type=str, help="The API token for surveys that don't list one in the manifest.")
+    parser.add_argument('--o', type=str, default='.', help='Where to put the survey directories. (Default .)')
+    parser.add_argument('--dc', type=str, default='az1', help='The Qualtrics data center. (Default az1)')
+    parser.add_argument('--url', type=str,
+                        help='The base url of the Qualtrics API, overrides --dc. Ex https://az1.qualtrics.com/API/v3/')
+    parser.add_argument('--interval', type=float, default=60,
+                        help='How many seconds to wait between checks of each survey. (Default 60)')
+    parser.add_argument('--once', action='store_true',
+                        help='Check every survey once and stop.')
+    parser.add_argument('--timeout', type=float, default=600,
+                        help='How many seconds to wait for Qualtrics to prepare each export. (Default 600)')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='How many surveys may be checked or exported at the same time. (Default 4)')
+    survey_response.add_output_arguments(parser)
+    args = parser.parse_args()
+    main(args)